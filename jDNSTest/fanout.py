@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import socket
+import time
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Listener, wait
+
+import jdns
+
+# Coordinator/worker mode for jdns. The coordinator splits the (website, dns_server) pairs
+# between workers, every worker runs num_tests lookups of each of its pairs with jdns and
+# streams each result back as soon as it has it, and the coordinator merges everything into
+# one dataset. Worker timestamps are moved onto the coordinator's clock using an offset
+# measured with a few ping/pong round trips when the worker connects.
+#
+# Workers are either local processes connected by pipes (no network needed):
+#   python fanout.py local --workers 8
+# or other hosts connected over TCP with multiprocessing's authenticated connections:
+#   python fanout.py serve --listen 0.0.0.0:7353 --workers 3 --authkey secret
+#   python fanout.py worker --connect coordinator:7353 --authkey secret
+
+# Number of ping/pong round trips used to estimate a worker's clock offset
+clock_pings = 5
+
+
+# Sends each result back to the coordinator as soon as the worker has it
+class ConnectionSink:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, test_result):
+        # jdns stamps results in local time, which means nothing on another host, so send UTC
+        timestamp = datetime.datetime.fromisoformat(test_result["timestamp"]).astimezone(datetime.timezone.utc)
+        test_result["timestamp"] = timestamp.isoformat()
+        self.conn.send({"type": "result", "result": test_result})
+
+    def close(self):
+        pass
+
+
+# Function run by every worker, answers the coordinator's messages until told to stop
+def worker_main(conn, name=None):
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    try:
+        while True:
+            msg = conn.recv()
+            if msg["type"] == "ping":
+                conn.send({"type": "pong", "t0": msg["t0"], "t1": time.time(), "name": name})
+            elif msg["type"] == "job":
+                run_job(conn, msg)
+                conn.send({"type": "done"})
+            elif msg["type"] == "stop":
+                break
+    except EOFError:
+        pass  # coordinator went away
+    finally:
+        conn.close()
+
+
+# Function to run one shard of the tests and stream the results over conn
+def run_job(conn, job):
+    sink = ConnectionSink(conn)
+    pairs = {tuple(pair) for pair in job["pairs"]}
+    websites = list(dict.fromkeys(website for website, _ in job["pairs"]))
+    dns_servers = list(dict.fromkeys(dns_server for _, dns_server in job["pairs"]))
+    # jdns runs every website against every server, so the pairs of that matrix outside the
+    # shard are skipped by passing them as already completed
+    completed = {tuple(test) for test in job["completed"]}
+    completed.update((website, dns_server, test_num + 1)
+                     for website in websites for dns_server in dns_servers if (website, dns_server) not in pairs
+                     for test_num in range(job["num_tests"]))
+    if job["use_async"]:
+        asyncio.run(jdns.perform_tests_async(websites, dns_servers, job["num_tests"],
+                                             job["max_in_flight"], job["per_server_limit"],
+                                             sink, completed, job["cache_mode"]))
+    else:
+        jdns.perform_tests(websites, dns_servers, job["num_tests"], sink, completed, job["cache_mode"])
+
+
+# Function to estimate how far a worker's clock is ahead of ours, in seconds. Uses the round
+# trip with the lowest latency, assuming the reply was stamped halfway through it
+def measure_clock_offset(conn):
+    best = None
+    for _ in range(clock_pings):
+        t0 = time.time()
+        conn.send({"type": "ping", "t0": t0})
+        pong = conn.recv()
+        t2 = time.time()
+        if best is None or t2 - t0 < best[0]:
+            best = (t2 - t0, pong["t1"] - (t0 + t2) / 2, pong["name"])
+    return best[1], best[2]
+
+
+# Function to split the (website, dns_server) pairs into at most num_shards round-robin
+# shards, so every worker gets work even when there are fewer websites than workers
+def shard_pairs(websites, dns_servers, num_shards):
+    pairs = [(website, dns_server) for website in websites for dns_server in dns_servers]
+    shards = [pairs[i::num_shards] for i in range(num_shards)]
+    return [shard for shard in shards if shard]
+
+
+# Function to move a worker's result onto the coordinator's clock and tag it with the worker.
+# Workers send UTC timestamps, the corrected one is in local time like jdns's own
+def correct_result(test_result, worker, offset):
+    timestamp = datetime.datetime.fromisoformat(test_result["timestamp"]) - datetime.timedelta(seconds=offset)
+    test_result["timestamp"] = timestamp.astimezone().replace(tzinfo=None).isoformat()
+    test_result["worker"] = worker
+    return test_result
+
+
+# Function to hand the shards out to the connected workers and merge what they send back.
+# Returns the merged results, or an empty list when they were written to sink
+def run_coordinator(conns, websites, dns_servers, num_tests, sink=None, completed=(), cache_mode="none",
+                    use_async=False, max_in_flight=jdns.max_in_flight, per_server_limit=jdns.per_server_limit):
+    workers = {}
+    for conn in conns:
+        offset, name = measure_clock_offset(conn)
+        workers[conn] = (name, offset)
+        print(f"Worker {name}: clock offset {offset * 1000:.3f} ms")
+
+    active = set()
+    for conn, shard in zip(conns, shard_pairs(websites, dns_servers, len(conns))):
+        pairs = set(shard)
+        conn.send({
+            "type": "job",
+            "pairs": shard,
+            "num_tests": num_tests,
+            "completed": [test for test in completed if (test[0], test[1]) in pairs],
+            "cache_mode": cache_mode,
+            "use_async": use_async,
+            "max_in_flight": max_in_flight,
+            "per_server_limit": per_server_limit
+        })
+        active.add(conn)
+
+    test_results = []
+    record = sink.write if sink else test_results.append
+    while active:
+        for conn in wait(active):
+            name, offset = workers[conn]
+            try:
+                msg = conn.recv()
+            except EOFError:
+                print(f"Worker {name} disconnected before finishing its shard")
+                active.discard(conn)
+                continue
+            if msg["type"] == "result":
+                record(correct_result(msg["result"], name, offset))
+            elif msg["type"] == "done":
+                active.discard(conn)
+
+    for conn in conns:
+        try:
+            conn.send({"type": "stop"})
+        except OSError:
+            pass
+        conn.close()
+    return test_results
+
+
+# Function to run the tests on local worker processes connected by pipes
+def run_local(num_workers, *args, **kwargs):
+    conns, processes = [], []
+    for i in range(num_workers):
+        parent_conn, child_conn = Pipe()
+        process = Process(target=worker_main, args=(child_conn, f"local-{i}"), daemon=True)
+        process.start()
+        child_conn.close()
+        conns.append(parent_conn)
+        processes.append(process)
+    try:
+        return run_coordinator(conns, *args, **kwargs)
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+
+
+# Function to wait for num_workers remote workers to connect and run the tests on them
+def run_server(address, authkey, num_workers, *args, **kwargs):
+    with Listener(address, authkey=authkey) as listener:
+        print(f"Waiting for {num_workers} workers on {address[0]}:{address[1]}")
+        conns = [listener.accept() for _ in range(num_workers)]
+    return run_coordinator(conns, *args, **kwargs)
+
+
+# Function to connect to a coordinator and work for it until it is finished
+def run_worker(address, authkey):
+    worker_main(Client(address, authkey=authkey))
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run jdns across many processes or hosts")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    local = subparsers.add_parser("local", help="Coordinate worker processes on this machine")
+    serve = subparsers.add_parser("serve", help="Coordinate workers on other hosts over TCP")
+    worker = subparsers.add_parser("worker", help="Work for a coordinator started with serve")
+
+    for coordinator in (local, serve):
+        coordinator.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of workers")
+        coordinator.add_argument("--servers", nargs="+", default=jdns.dns_servers,
+                                 help="DNS servers to test, as host or host:port")
+        coordinator.add_argument("--websites", nargs="+", default=jdns.websites, help="Websites to look up")
+        coordinator.add_argument("--num-tests", type=int, default=jdns.num_tests,
+                                 help="Lookups per website and server")
+        coordinator.add_argument("--cache-mode", choices=jdns.cache_modes, default="none",
+                                 help="Cache mode to measure")
+        coordinator.add_argument("--async", dest="use_async", action="store_true",
+                                 help="Run each worker's lookups concurrently with asyncio")
+        coordinator.add_argument("--max-in-flight", type=int, default=jdns.max_in_flight,
+                                 help="Maximum lookups in flight at once per worker (async mode)")
+        coordinator.add_argument("--per-server-limit", type=int, default=jdns.per_server_limit,
+                                 help="Maximum lookups in flight per DNS server per worker (async mode)")
+        coordinator.add_argument("--output", help="Stream merged results to this file (ndjson) or directory (arrow)")
+        coordinator.add_argument("--format", dest="output_format", choices=sorted(jdns.result_sinks),
+                                 default="ndjson", help="Format for --output")
+        coordinator.add_argument("--resume", action="store_true",
+                                 help="Skip lookups that are already saved in --output")
+
+    serve.add_argument("--listen", default="0.0.0.0:7353", help="Address to accept workers on")
+    serve.add_argument("--authkey", required=True, help="Shared secret workers must present")
+    worker.add_argument("--connect", required=True, help="Coordinator address as host:port")
+    worker.add_argument("--authkey", required=True, help="Shared secret of the coordinator")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.role == "worker":
+        run_worker(parse_address(args.connect), args.authkey.encode())
+    else:
+        completed = set()
+        sink = None
+        if args.output:
+            if args.resume:
+                completed = jdns.load_completed(args.output, args.output_format, args.cache_mode)
+                print(f"Resuming, {len(completed)} lookups already saved")
+            sink = jdns.result_sinks[args.output_format](args.output)
+
+        start_time = time.perf_counter()
+        test_args = (args.websites, args.servers, args.num_tests, sink, completed, args.cache_mode,
+                     args.use_async, args.max_in_flight, args.per_server_limit)
+        try:
+            if args.role == "local":
+                test_results = run_local(args.workers, *test_args)
+            else:
+                test_results = run_server(parse_address(args.listen), args.authkey.encode(), args.workers,
+                                          *test_args)
+        finally:
+            if sink:
+                sink.close()
+        print(f"Finished in {time.perf_counter() - start_time:.1f} s")
+
+        if not sink:
+            with open("dns_test_results.json", "w") as f:
+                json.dump(test_results, f, indent=4)
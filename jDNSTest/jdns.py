@@ -1,7 +1,16 @@
-import dns.resolver
+import argparse
+import asyncio
+import dns.exception
+import dns.message
+import dns.rcode
+import socket
 import time
 import datetime
+import heapq
+import itertools
 import json
+import os
+import uuid
 import matplotlib.pyplot as plt
 import pandas as pd
 
@@ -29,41 +38,426 @@ dns_servers = [
 # Number of times to test each website
 num_tests = 5
 
+# Maximum number of lookups in flight at once in async mode
+max_in_flight = 50
+
+# Maximum number of lookups in flight against any single DNS server in async mode
+per_server_limit = 8
+
+# Seconds to wait for a single DNS response
+lookup_timeout = 2.0
+
+# Cache modes a run can measure:
+#   none - plain repeated lookups, the first is usually a cache miss and the rest hits
+#   cold - every lookup asks for a random unique subdomain so the resolver must recurse
+#   warm - an unrecorded lookup primes the resolver's cache before the measured ones
+#   ttl  - every repeat is sent just after the previous answer's TTL has expired
+cache_modes = ["none", "cold", "warm", "ttl"]
+
+# Seconds to wait past a record's TTL before the next ttl mode lookup, and how long to wait
+# instead when the previous lookup failed and there is no TTL to go by
+ttl_margin = 0.5
+ttl_fallback = 30
+
+# Number of results buffered by a results sink before it is flushed to disk
+flush_every = 100
+
+# Number of saved results turned into a DataFrame at a time when they are read back
+read_chunk = 100_000
+
+# Connected UDP sockets, built once per DNS server and reused for every lookup
+server_sockets = {}
+
+
+# Function to split a "host" or "host:port" server string into its address and port
+def parse_dns_server(dns_server):
+    if dns_server.startswith("["):  # [IPv6]:port
+        host, _, port = dns_server[1:].partition("]:")
+        return host, int(port) if port else 53
+    if dns_server.count(":") == 1:
+        host, port = dns_server.split(":")
+        return host, int(port)
+    return dns_server, 53
+
+
+# Function to get the reusable socket for a DNS server, creating it on first use
+def get_server_socket(dns_server):
+    sock = server_sockets.get(dns_server)
+    if sock is None:
+        host, port = parse_dns_server(dns_server)
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.settimeout(lookup_timeout)
+        sock.connect((host, port))
+        server_sockets[dns_server] = sock
+    return sock
+
+
+# Function to drop a server's socket, e.g. after a timeout so a late reply can't be
+# read as the answer to the next query
+def discard_server_socket(dns_server):
+    sock = server_sockets.pop(dns_server, None)
+    if sock is not None:
+        sock.close()
+
+
+# Function to build a query for a website (an A query unless another record type is given),
+# returns the message and its wire format.
+# In cold mode a random subdomain is asked for so the answer can't come from a cache
+def build_query(website, cache_mode="none", record_type='A'):
+    if cache_mode == "cold":
+        website = f"{uuid.uuid4().hex[:16]}.{website}"
+    query = dns.message.make_query(website, record_type)
+    return query, query.to_wire()
+
+
+# Function to parse a response and make sure it is a successful answer to the query.
+# NXDOMAIN is expected for the made-up names of cold mode
+def parse_response(query, data, cache_mode="none"):
+    response = dns.message.from_wire(data)
+    if not query.is_response(response):
+        raise dns.exception.DNSException("response does not match query")
+    rcode = response.rcode()
+    if rcode != dns.rcode.NOERROR and not (cache_mode == "cold" and rcode == dns.rcode.NXDOMAIN):
+        raise dns.exception.DNSException(dns.rcode.to_text(rcode))
+    return response
+
+
+# Function to get the remaining TTL of an answer in seconds, None if it has no records
+def answer_ttl(response):
+    ttls = [rrset.ttl for rrset in response.answer]
+    return min(ttls) if ttls else None
+
+
+# Function to convert the perf_counter_ns marks of one lookup into milliseconds.
+# setup is building the query, lookup is the network round-trip, parse is decoding the reply
+def make_lookup_timing(start_ns, sent_ns, received_ns, parsed_ns, ttl=None):
+    return {
+        "setup_time_ms": (sent_ns - start_ns) / 1e6,
+        "lookup_time_ms": (received_ns - sent_ns) / 1e6,
+        "parse_time_ms": (parsed_ns - received_ns) / 1e6,
+        "ttl": ttl
+    }
+
 
 # Function to perform DNS lookup and measure the time taken
-def dns_lookup_time(website, dns_server):
-    resolver = dns.resolver.Resolver()
-    resolver.nameservers = [dns_server]
-    start_time = time.time()
+def dns_lookup_time(website, dns_server, cache_mode="none"):
     try:
-        resolver.resolve(website, 'A')
-        end_time = time.time()
-        lookup_time = (end_time - start_time) * 1000  # convert to milliseconds
-        return lookup_time
-    except dns.exception.DNSException as e:
+        sock = get_server_socket(dns_server)
+        start_ns = time.perf_counter_ns()
+        query, wire = build_query(website, cache_mode)
+        sent_ns = time.perf_counter_ns()
+        sock.send(wire)
+        data = sock.recv(65535)
+        received_ns = time.perf_counter_ns()
+        response = parse_response(query, data, cache_mode)
+        parsed_ns = time.perf_counter_ns()
+        return make_lookup_timing(start_ns, sent_ns, received_ns, parsed_ns, answer_ttl(response))
+    except (OSError, dns.exception.DNSException) as e:
+        if isinstance(e, OSError):
+            discard_server_socket(dns_server)
         print(f"Error resolving {website} using {dns_server}: {e}")
         return None
 
 
-# Function to perform the tests and collect data
-def perform_tests(websites, dns_servers, num_tests):
+# Function to build the result record for a single lookup
+def make_test_result(website, dns_server, timing, test_num, cache_mode="none"):
+    timing = timing or {}
+    return {
+        "website": website,
+        "dns_server": dns_server,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "lookup_time_ms": timing.get("lookup_time_ms"),
+        "setup_time_ms": timing.get("setup_time_ms"),
+        "parse_time_ms": timing.get("parse_time_ms"),
+        "ttl": timing.get("ttl"),
+        "cache_mode": cache_mode,
+        "test_number": test_num + 1
+    }
+
+
+# Function to list the test numbers (0-based) of a pair that still need to run
+def remaining_tests(website, dns_server, num_tests, completed):
+    return [test_num for test_num in range(num_tests)
+            if (website, dns_server, test_num + 1) not in completed]
+
+
+# Function to work out when the next ttl mode lookup is due, on the time.monotonic() clock
+def next_due(timing):
+    ttl = timing["ttl"] if timing and timing["ttl"] is not None else ttl_fallback
+    return time.monotonic() + ttl + ttl_margin
+
+
+# Function to perform the tests and collect data. With a sink each result is written to it
+# as soon as it arrives instead of being kept in memory, and (website, dns_server,
+# test_number) tuples in completed are skipped
+def perform_tests(websites, dns_servers, num_tests, sink=None, completed=(), cache_mode="none"):
     test_results = []
+    record = sink.write if sink else test_results.append
+    if cache_mode == "ttl":
+        perform_ttl_tests(websites, dns_servers, num_tests, record, completed)
+        return test_results
     for website in websites:
         for dns_server in dns_servers:
-            for test_num in range(num_tests):
-                lookup_time = dns_lookup_time(website, dns_server)
-                test_result = {
-                    "website": website,
-                    "dns_server": dns_server,
-                    "timestamp": datetime.datetime.now().isoformat(),
-                    "lookup_time_ms": lookup_time,
-                    "test_number": test_num + 1
-                }
-                test_results.append(test_result)
+            pending = remaining_tests(website, dns_server, num_tests, completed)
+            if pending and cache_mode == "warm":
+                dns_lookup_time(website, dns_server)  # prime the cache, not recorded
+            for test_num in pending:
+                timing = dns_lookup_time(website, dns_server, cache_mode)
+                record(make_test_result(website, dns_server, timing, test_num, cache_mode))
     return test_results
 
 
-# Function to visualize the results
+# Function to run the ttl mode tests. Waiting out every TTL one pair at a time would take
+# forever, so all pairs share a heap ordered by when their next lookup is due
+def perform_ttl_tests(websites, dns_servers, num_tests, record, completed):
+    schedule = []
+    for website in websites:
+        for dns_server in dns_servers:
+            pending = remaining_tests(website, dns_server, num_tests, completed)
+            if not pending:
+                continue
+            # A resumed pair needs a fresh TTL to line its next lookup up with
+            due = time.monotonic() if pending[0] == 0 else next_due(dns_lookup_time(website, dns_server))
+            heapq.heappush(schedule, (due, website, dns_server, pending))
+
+    while schedule:
+        due, website, dns_server, pending = heapq.heappop(schedule)
+        time.sleep(max(0, due - time.monotonic()))
+        timing = dns_lookup_time(website, dns_server, "ttl")
+        record(make_test_result(website, dns_server, timing, pending[0], "ttl"))
+        if len(pending) > 1:
+            heapq.heappush(schedule, (next_due(timing), website, dns_server, pending[1:]))
+
+
+# Async version of dns_lookup_time. Concurrent lookups can't share one socket, so each
+# opens its own and that cost is counted as setup time
+async def async_dns_lookup_time(website, dns_server, cache_mode="none"):
+    loop = asyncio.get_running_loop()
+    host, port = parse_dns_server(dns_server)
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    try:
+        start_ns = time.perf_counter_ns()
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.setblocking(False)
+            sock.connect((host, port))
+            query, wire = build_query(website, cache_mode)
+            sent_ns = time.perf_counter_ns()
+            await loop.sock_sendall(sock, wire)
+            data = await asyncio.wait_for(loop.sock_recv(sock, 65535), lookup_timeout)
+            received_ns = time.perf_counter_ns()
+        response = parse_response(query, data, cache_mode)
+        parsed_ns = time.perf_counter_ns()
+        return make_lookup_timing(start_ns, sent_ns, received_ns, parsed_ns, answer_ttl(response))
+    except (OSError, asyncio.TimeoutError, dns.exception.DNSException) as e:
+        print(f"Error resolving {website} using {dns_server}: {str(e) or 'timed out'}")
+        return None
+
+
+# Function to perform the tests concurrently, keeping up to max_in_flight lookups
+# running overall and at most per_server_limit against any one DNS server.
+# sink, completed and cache_mode work the same way as in perform_tests
+async def perform_tests_async(websites, dns_servers, num_tests,
+                              max_in_flight=max_in_flight, per_server_limit=per_server_limit,
+                              sink=None, completed=(), cache_mode="none"):
+    server_slots = {dns_server: asyncio.Semaphore(per_server_limit) for dns_server in dns_servers}
+    global_slots = asyncio.Semaphore(max_in_flight)
+    pairs = [(website, dns_server, remaining_tests(website, dns_server, num_tests, completed))
+             for website in websites for dns_server in dns_servers]
+    pairs = [pair for pair in pairs if pair[2]]
+
+    async def lookup(website, dns_server, mode):
+        # Take the per-server slot first so a slow server can't hold global slots while it waits
+        async with server_slots[dns_server]:
+            async with global_slots:
+                return await async_dns_lookup_time(website, dns_server, mode)
+
+    def save(test_result):
+        if sink:
+            sink.write(test_result)
+            return None
+        return test_result
+
+    async def run_test(website, dns_server, test_num):
+        timing = await lookup(website, dns_server, cache_mode)
+        return [save(make_test_result(website, dns_server, timing, test_num, cache_mode))]
+
+    async def run_ttl_chain(website, dns_server, pending):
+        # Repeats of a pair have to wait for the previous answer to expire, so they run in
+        # order, sleeping outside the concurrency slots
+        # A resumed pair needs a fresh TTL to line its next lookup up with
+        due = time.monotonic() if pending[0] == 0 else next_due(await lookup(website, dns_server, "none"))
+        results = []
+        for test_num in pending:
+            await asyncio.sleep(max(0, due - time.monotonic()))
+            timing = await lookup(website, dns_server, "ttl")
+            due = next_due(timing)
+            results.append(save(make_test_result(website, dns_server, timing, test_num, "ttl")))
+        return results
+
+    if cache_mode == "warm":
+        # Prime every pair's cache first, these lookups are not recorded
+        await asyncio.gather(*(lookup(website, dns_server, "none") for website, dns_server, _ in pairs))
+
+    if cache_mode == "ttl":
+        runs = [run_ttl_chain(website, dns_server, pending) for website, dns_server, pending in pairs]
+    else:
+        runs = [run_test(website, dns_server, test_num)
+                for website, dns_server, pending in pairs for test_num in pending]
+
+    # gather keeps the results in the same order as the sequential version
+    test_results = [test_result for results in await asyncio.gather(*runs) for test_result in results]
+    return [] if sink else test_results
+
+
+# Streams results to an append-only newline-delimited JSON file, one result per line
+class NDJSONSink:
+    def __init__(self, path, flush_every=flush_every):
+        self.path = path
+        self.flush_every = flush_every
+        self.pending = 0
+        self.file = open(path, "a")
+        # A crash can leave a half-written last line, start on a fresh one
+        if self.file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def write(self, test_result):
+        self.file.write(json.dumps(test_result) + "\n")
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from an interrupted run
+
+
+# Streams results as Arrow record batches. path is a directory and every run writes its
+# own part file, so an interrupted run still leaves all of its flushed batches readable
+class ArrowSink:
+    def __init__(self, path, flush_every=flush_every):
+        import pyarrow as pa
+
+        self.pa = pa
+        self.schema = pa.schema([
+            ("website", pa.string()),
+            ("dns_server", pa.string()),
+            ("timestamp", pa.string()),
+            ("lookup_time_ms", pa.float64()),
+            ("setup_time_ms", pa.float64()),
+            ("parse_time_ms", pa.float64()),
+            ("ttl", pa.int64()),
+            ("cache_mode", pa.string()),
+            ("test_number", pa.int64()),
+            ("worker", pa.string()),
+            ("protocol", pa.string()),
+            ("connection", pa.string()),
+            ("record_type", pa.string()),
+            ("connect_time_ms", pa.float64()),
+            ("reused_connection", pa.bool_())
+        ])
+        self.flush_every = flush_every
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        part = os.path.join(path, f"part-{datetime.datetime.now():%Y%m%dT%H%M%S%f}.arrow")
+        self.file = pa.OSFile(part, "wb")
+        self.writer = pa.ipc.new_stream(self.file, self.schema)
+
+    def write(self, test_result):
+        self.rows.append(test_result)
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.writer.write_batch(self.pa.RecordBatch.from_pylist(self.rows, schema=self.schema))
+            self.file.flush()
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        for table in ArrowSink.read_tables(path):
+            yield from table.to_pylist()
+
+    # Yields one table per part file holding every batch that was completely written
+    @staticmethod
+    def read_tables(path):
+        import pyarrow as pa
+
+        if not os.path.isdir(path):
+            return
+        for name in sorted(os.listdir(path)):
+            if not name.endswith(".arrow"):
+                continue
+            batches = []
+            try:
+                with pa.ipc.open_stream(os.path.join(path, name)) as reader:
+                    schema = reader.schema
+                    for batch in reader:
+                        batches.append(batch)
+            except pa.ArrowInvalid:
+                pass  # stop at the batch an interrupted run was writing
+            if batches:
+                yield pa.Table.from_batches(batches, schema)
+
+
+result_sinks = {
+    "ndjson": NDJSONSink,
+    "arrow": ArrowSink
+}
+
+
+# Function to read what a sink saved into a DataFrame, a chunk at a time so the results are
+# never all held as dicts at once
+def load_results_frame(path, output_format):
+    if output_format == "arrow":
+        import pyarrow as pa
+
+        tables = list(ArrowSink.read_tables(path))
+        return pa.concat_tables(tables, promote_options="default").to_pandas() if tables else pd.DataFrame()
+    rows = result_sinks[output_format].read(path)
+    frames = []
+    while True:
+        chunk = list(itertools.islice(rows, read_chunk))
+        if not chunk:
+            break
+        frames.append(pd.DataFrame(chunk))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+# Function to find the (website, dns_server, test_number) tuples of a cache mode already
+# saved by a sink
+def load_completed(path, output_format, cache_mode="none"):
+    return {(r["website"], r["dns_server"], r["test_number"])
+            for r in result_sinks[output_format].read(path)
+            if r.get("cache_mode", "none") == cache_mode}
+
+
+# Function to visualize the results, a list of result dicts or a DataFrame of them
 def visualize_results(test_results):
     # Create a DataFrame from the test results
     df = pd.DataFrame(test_results)
@@ -71,14 +465,13 @@ def visualize_results(test_results):
     # Filter out rows with None lookup times
     df = df[df['lookup_time_ms'].notna()]
 
-    # Create a line plot for each website showing the lookup times for each DNS server
+    # Create a line plot for each website showing the lookup times for each DNS server.
+    # One pivot gives a column per line, for big runs use report.py instead
     fig, ax = plt.subplots(figsize=(15, 10))
-    for dns_server in dns_servers:
-        server_data = df[df['dns_server'] == dns_server]
-        for website in websites:
-            website_data = server_data[server_data['website'] == website]
-            ax.plot(website_data['test_number'], website_data['lookup_time_ms'], marker='o',
-                    label=f"{website} ({dns_server})")
+    lines = df.pivot_table(index='test_number', columns=['website', 'dns_server', 'cache_mode'],
+                           values='lookup_time_ms')
+    lines.columns = [f"{website} ({dns_server}, {cache_mode})" for website, dns_server, cache_mode in lines.columns]
+    lines.plot(ax=ax, marker='o')
 
     ax.set_title('DNS Lookup Time Comparison')
     ax.set_xlabel('Test Number')
@@ -88,19 +481,89 @@ def visualize_results(test_results):
     plt.show()
 
     # Calculate and print summary statistics
-    summary = df.groupby(['website', 'dns_server'])['lookup_time_ms'].describe()
+    summary = df.groupby(['cache_mode', 'website', 'dns_server'])['lookup_time_ms'].describe()
     print(summary)
 
+    # Percentiles per cache mode, to see how much of the tail is recursion and how much round-trip
+    percentiles = df.groupby(['dns_server', 'cache_mode'])['lookup_time_ms'].quantile([0.5, 0.95, 0.99])
+    print(percentiles.unstack())
+
+    # Split each server's average time into client setup, network round-trip and parsing
+    split = df.groupby('dns_server')[['setup_time_ms', 'lookup_time_ms', 'parse_time_ms']].mean()
+    print(split)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare DNS lookup times across DNS servers")
+    parser.add_argument("--servers", nargs="+", default=dns_servers,
+                        help="DNS servers to test, as host or host:port")
+    parser.add_argument("--websites", nargs="+", default=websites, help="Websites to look up")
+    parser.add_argument("--num-tests", type=int, default=num_tests, help="Lookups per website and server")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run lookups concurrently with asyncio")
+    parser.add_argument("--max-in-flight", type=int, default=max_in_flight,
+                        help="Maximum lookups in flight at once (async mode)")
+    parser.add_argument("--per-server-limit", type=int, default=per_server_limit,
+                        help="Maximum lookups in flight per DNS server (async mode)")
+    parser.add_argument("--cache-modes", nargs="+", choices=cache_modes, default=["none"],
+                        help="Cache modes to measure, each one is a separate pass with its own stats")
+    parser.add_argument("--output", help="Stream results to this file (ndjson) or directory (arrow) "
+                                         "as they arrive instead of keeping them in memory")
+    parser.add_argument("--format", dest="output_format", choices=sorted(result_sinks), default="ndjson",
+                        help="Format for --output")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip lookups that are already saved in --output")
+    parser.add_argument("--report", metavar="DIR",
+                        help="Write a headless HTML/PNG report to DIR instead of opening a plot window")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    websites = args.websites
+    dns_servers = args.servers
+
+    sink = None
+    if args.output:
+        sink = result_sinks[args.output_format](args.output)
+
+    # Perform the tests and collect the data, one pass per cache mode
+    test_results = []
+    try:
+        for cache_mode in args.cache_modes:
+            completed = set()
+            if args.output and args.resume:
+                completed = load_completed(args.output, args.output_format, cache_mode)
+                print(f"Resuming {cache_mode} mode, {len(completed)} lookups already saved")
+            if args.use_async:
+                test_results += asyncio.run(perform_tests_async(websites, dns_servers, args.num_tests,
+                                                                args.max_in_flight, args.per_server_limit,
+                                                                sink, completed, cache_mode))
+            else:
+                test_results += perform_tests(websites, dns_servers, args.num_tests, sink, completed, cache_mode)
+    finally:
+        if sink:
+            sink.close()
 
-# Perform the tests and collect the data
-test_results = perform_tests(websites, dns_servers, num_tests)
+    if not sink:
+        # Print the results
+        print(json.dumps(test_results, indent=4))
 
-# Print the results
-print(json.dumps(test_results, indent=4))
+        # Optionally, save the results to a file
+        with open("dns_test_results.json", "w") as f:
+            json.dump(test_results, f, indent=4)
 
-# Optionally, save the results to a file
-with open("dns_test_results.json", "w") as f:
-    json.dump(test_results, f, indent=4)
+    # Visualize the results. Streamed results are on disk already and are read straight into
+    # a DataFrame rather than back into a list
+    if args.report:
+        import report
 
-# Visualize the results
-visualize_results(test_results)
+        if sink:
+            report_path = report.write_report(args.output, args.report, args.output_format)
+        else:
+            report_path = report.write_report(test_results, args.report)
+        print(f"Report written to {report_path}")
+    elif sink:
+        visualize_results(load_results_frame(args.output, args.output_format))
+    else:
+        visualize_results(test_results)
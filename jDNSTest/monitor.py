@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jdns
+
+# Long-running DNS monitor. Each DNS server is sampled at a fixed rate, cycling through the
+# websites, and the lookup times are kept in rolling quantile sketches instead of raw samples
+# so memory stays bounded no matter how long it runs. The current numbers are served at
+# http://<host>:<port>/metrics in the Prometheus text format.
+
+# Lookups per second sent to each DNS server
+sample_rate = 2.0
+
+# Length of the rolling window in seconds, and how many buckets it is split into
+window_seconds = 300
+window_buckets = 5
+
+# Quantiles reported for each (website, dns_server)
+quantiles = [0.5, 0.95, 0.99]
+
+
+class DDSketch:
+    """Quantile sketch with bounded relative error (DDSketch, Masson et al. 2019)."""
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self.collapse()
+
+    def collapse(self):
+        # Fold the lowest bins together, which only loses accuracy on the fastest lookups
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.max_bins + 1]
+        folded = sum(self.bins.pop(key) for key in excess)
+        self.bins[excess[-1]] = folded
+
+    def merge(self, other):
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        if len(self.bins) > self.max_bins:
+            self.collapse()
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class RollingSketch:
+    """Ring of sketches covering the last window_seconds, one per bucket of time."""
+
+    def __init__(self, window_seconds=window_seconds, window_buckets=window_buckets):
+        self.bucket_seconds = window_seconds / window_buckets
+        self.buckets = deque(maxlen=window_buckets)
+
+    def add(self, value, now=None):
+        bucket = int((time.monotonic() if now is None else now) // self.bucket_seconds)
+        if not self.buckets or self.buckets[-1][0] != bucket:
+            self.buckets.append((bucket, DDSketch()))
+        self.buckets[-1][1].add(value)
+
+    def snapshot(self, now=None):
+        oldest = int((time.monotonic() if now is None else now) // self.bucket_seconds) - self.buckets.maxlen + 1
+        merged = DDSketch()
+        for bucket, sketch in self.buckets:
+            if bucket >= oldest:
+                merged.merge(sketch)
+        return merged
+
+
+class LookupStats:
+    """Rolling lookup times and error counts per (website, dns_server), safe to read from
+    the HTTP thread while the monitor loop writes to it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sketches = {}
+        self.totals = {}
+        self.errors = {}
+        self.dropped = {}
+
+    def record(self, website, dns_server, timing):
+        key = (website, dns_server)
+        with self.lock:
+            if timing is None:
+                self.errors[key] = self.errors.get(key, 0) + 1
+                return
+            if key not in self.sketches:
+                self.sketches[key] = RollingSketch()
+            self.sketches[key].add(timing["lookup_time_ms"])
+            # Prometheus needs a summary's sum and count to only go up, so they cover every
+            # lookup since the start while the quantiles cover the rolling window
+            count, total = self.totals.get(key, (0, 0.0))
+            self.totals[key] = (count + 1, total + timing["lookup_time_ms"])
+
+    def record_dropped(self, website, dns_server):
+        key = (website, dns_server)
+        with self.lock:
+            self.dropped[key] = self.dropped.get(key, 0) + 1
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP jdns_lookup_time_ms DNS lookup round-trip time, quantiles over the rolling window.",
+            "# TYPE jdns_lookup_time_ms summary"
+        ]
+        with self.lock:
+            snapshots = {key: sketch.snapshot() for key, sketch in self.sketches.items()}
+            totals = dict(self.totals)
+            errors = dict(self.errors)
+            dropped = dict(self.dropped)
+        for (website, dns_server), sketch in sorted(snapshots.items()):
+            labels = prometheus_labels(website=website, dns_server=dns_server)
+            for q in quantiles:
+                value = sketch.quantile(q)
+                if value is not None:
+                    quantile_labels = prometheus_labels(website=website, dns_server=dns_server, quantile=q)
+                    lines.append(f"jdns_lookup_time_ms{quantile_labels} {value:.3f}")
+            count, total = totals[website, dns_server]
+            lines.append(f"jdns_lookup_time_ms_sum{labels} {total:.3f}")
+            lines.append(f"jdns_lookup_time_ms_count{labels} {count}")
+        lines.append("# HELP jdns_lookup_errors_total Failed DNS lookups since the monitor started.")
+        lines.append("# TYPE jdns_lookup_errors_total counter")
+        for (website, dns_server), count in sorted(errors.items()):
+            lines.append(f"jdns_lookup_errors_total{prometheus_labels(website=website, dns_server=dns_server)} {count}")
+        lines.append("# HELP jdns_lookups_dropped_total Lookups skipped because the DNS server had too many unanswered.")
+        lines.append("# TYPE jdns_lookups_dropped_total counter")
+        for (website, dns_server), count in sorted(dropped.items()):
+            lines.append(f"jdns_lookups_dropped_total{prometheus_labels(website=website, dns_server=dns_server)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+# Function to format a Prometheus label set
+def prometheus_labels(**labels):
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+# Function to start the /metrics endpoint on a background thread
+def start_metrics_server(stats, host="127.0.0.1", port=9153):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = stats.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep scrapes out of the console
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Function to sample one DNS server at a fixed rate forever. Lookups are started on schedule
+# rather than after the previous one finishes, so a slow answer doesn't lower the rate. When
+# per_server_limit lookups are still unanswered the sample is dropped instead of queued, so a
+# dead server can't pile up waiting lookups
+async def sample_server(stats, websites, dns_server, sample_rate=sample_rate):
+    interval = 1 / sample_rate
+    next_time = time.monotonic()
+
+    async def sample(website):
+        timing = await jdns.async_dns_lookup_time(website, dns_server)
+        stats.record(website, dns_server, timing)
+
+    tasks = set()
+    for website in itertools.cycle(websites):
+        if len(tasks) >= jdns.per_server_limit:
+            stats.record_dropped(website, dns_server)
+        else:
+            task = asyncio.create_task(sample(website))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        next_time += interval
+        await asyncio.sleep(max(0, next_time - time.monotonic()))
+
+
+async def run_monitor(websites, dns_servers, sample_rate=sample_rate, host="127.0.0.1", port=9153):
+    stats = LookupStats()
+    server = start_metrics_server(stats, host, port)
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    try:
+        await asyncio.gather(*(sample_server(stats, websites, dns_server, sample_rate)
+                               for dns_server in dns_servers))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Continuously monitor DNS lookup times")
+    parser.add_argument("--servers", nargs="+", default=jdns.dns_servers,
+                        help="DNS servers to monitor, as host or host:port")
+    parser.add_argument("--websites", nargs="+", default=jdns.websites, help="Websites to look up")
+    parser.add_argument("--rate", type=float, default=sample_rate, help="Lookups per second per DNS server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address for the /metrics endpoint")
+    parser.add_argument("--port", type=int, default=9153, help="Port for the /metrics endpoint")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_monitor(args.websites, args.servers, args.rate, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
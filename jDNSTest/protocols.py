@@ -0,0 +1,286 @@
+import argparse
+import http.client
+import json
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import dns.exception
+import pandas as pd
+
+import jdns
+
+# Protocol comparison for jdns. Each target is a DNS server reached over one transport:
+#   udp://1.1.1.1   tcp://1.1.1.1   tls://1.1.1.1   https://1.1.1.1/dns-query
+# and every transport is measured both with a new connection per query ("cold") and with one
+# connection kept open and reused ("pooled"). Connection setup (TCP and TLS handshakes) is
+# timed separately from the query itself, so the cost of each can be compared:
+#   python protocols.py --servers 1.1.1.1 --protocols udp tcp tls https
+# Use stubdns.py for an offline stand-in of every transport.
+
+# Record types queried for every website
+record_types = ["A", "AAAA", "HTTPS"]
+
+# Connection modes, a new connection for every query or one reused connection per target
+connection_modes = ["cold", "pooled"]
+
+
+class UDPTransport:
+    default_port = 53
+
+    def __init__(self, host, port, path, ssl_context):
+        self.host = host
+        self.port = port or self.default_port
+        self.path = path
+        self.ssl_context = ssl_context
+        self.sock = None
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.settimeout(jdns.lookup_timeout)
+        self.sock.connect((self.host, self.port))
+
+    def exchange(self, wire):
+        self.sock.send(wire)
+        return self.sock.recv(65535)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class TCPTransport(UDPTransport):
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=jdns.lookup_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    # DNS over a stream prefixes every message with its length as two bytes
+    def exchange(self, wire):
+        self.sock.sendall(len(wire).to_bytes(2, "big") + wire)
+        size = int.from_bytes(self.recv_exactly(2), "big")
+        return self.recv_exactly(size)
+
+    def recv_exactly(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("connection closed by server")
+            data += chunk
+        return data
+
+
+class TLSTransport(TCPTransport):
+    default_port = 853
+
+    def connect(self):
+        super().connect()
+        # The handshake happens here, so it is part of the connect time
+        self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+class HTTPSTransport:
+    default_port = 443
+
+    def __init__(self, host, port, path, ssl_context):
+        self.host = host
+        self.port = port or self.default_port
+        self.path = path or "/dns-query"
+        self.ssl_context = ssl_context
+        self.conn = None
+
+    @property
+    def connected(self):
+        return self.conn is not None
+
+    def new_connection(self):
+        return http.client.HTTPSConnection(self.host, self.port, timeout=jdns.lookup_timeout,
+                                           context=self.ssl_context)
+
+    def connect(self):
+        self.conn = self.new_connection()
+        self.conn.connect()
+
+    def exchange(self, wire):
+        self.conn.request("POST", self.path, body=wire, headers={
+            "Content-Type": "application/dns-message",
+            "Accept": "application/dns-message"
+        })
+        response = self.conn.getresponse()
+        data = response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"HTTP {response.status} {response.reason}")
+        return data
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+# DoH without TLS, only meant for local stand-in servers
+class HTTPTransport(HTTPSTransport):
+    default_port = 80
+
+    def new_connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=jdns.lookup_timeout)
+
+
+transports = {
+    "udp": UDPTransport,
+    "tcp": TCPTransport,
+    "tls": TLSTransport,
+    "https": HTTPSTransport,
+    "http": HTTPTransport
+}
+
+
+# Function to build the transport for a target such as "tls://1.1.1.1" or "https://1.1.1.1/dns-query"
+def make_transport(target, ssl_context):
+    parts = urlsplit(target)
+    if parts.scheme not in transports:
+        raise ValueError(f"Unknown protocol in {target}, expected one of {', '.join(transports)}")
+    return transports[parts.scheme](parts.hostname, parts.port, parts.path, ssl_context)
+
+
+# Function to turn plain server addresses into targets for each protocol on its default port
+def expand_targets(dns_servers, protocols):
+    targets = []
+    for dns_server in dns_servers:
+        if dns_server.count(":") > 1 and not dns_server.startswith("["):
+            dns_server = f"[{dns_server}]"  # bare IPv6 address
+        for protocol in protocols:
+            targets.append(f"{protocol}://{dns_server}" + ("/dns-query" if protocol in ("https", "http") else ""))
+    return targets
+
+
+# Function to build the client SSL context for TLS and HTTPS targets
+def make_client_ssl_context(cafile=None, insecure=False):
+    context = ssl.create_default_context(cafile=cafile)
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+# Function to perform one lookup over a transport, connecting first if it isn't connected.
+# connect_time_ms is 0 when an open connection was reused
+def protocol_lookup_time(transport, website, record_type):
+    reused = transport.connected
+    start_ns = time.perf_counter_ns()
+    if not reused:
+        transport.connect()
+    connected_ns = time.perf_counter_ns()
+    query, wire = jdns.build_query(website, record_type=record_type)
+    sent_ns = time.perf_counter_ns()
+    data = transport.exchange(wire)
+    received_ns = time.perf_counter_ns()
+    response = jdns.parse_response(query, data)
+    parsed_ns = time.perf_counter_ns()
+    timing = jdns.make_lookup_timing(connected_ns, sent_ns, received_ns, parsed_ns, jdns.answer_ttl(response))
+    timing["connect_time_ms"] = (connected_ns - start_ns) / 1e6
+    timing["reused_connection"] = reused
+    return timing
+
+
+# Function to run every target in every connection mode and collect the results.
+# With a sink each result is written to it as soon as it arrives
+def perform_protocol_tests(websites, targets, num_tests, record_types=record_types,
+                           connection_modes=connection_modes, ssl_context=None, sink=None):
+    test_results = []
+    record = sink.write if sink else test_results.append
+    ssl_context = ssl_context or make_client_ssl_context()
+    for target in targets:
+        protocol = urlsplit(target).scheme
+        for connection_mode in connection_modes:
+            transport = make_transport(target, ssl_context)
+            try:
+                for website in websites:
+                    for record_type in record_types:
+                        for test_num in range(num_tests):
+                            try:
+                                timing = protocol_lookup_time(transport, website, record_type)
+                            except (OSError, http.client.HTTPException, dns.exception.DNSException) as e:
+                                print(f"Error resolving {website} {record_type} using {target}: {e}")
+                                timing = None
+                                transport.close()  # start over with a fresh connection
+                            if connection_mode == "cold":
+                                transport.close()
+                            test_result = jdns.make_test_result(website, target, timing, test_num)
+                            test_result.update({
+                                "protocol": protocol,
+                                "connection": connection_mode,
+                                "record_type": record_type,
+                                "connect_time_ms": timing and timing["connect_time_ms"],
+                                "reused_connection": timing and timing["reused_connection"]
+                            })
+                            record(test_result)
+            finally:
+                transport.close()
+    return test_results
+
+
+# Function to print connection setup cost and per-query cost for every target, from a list
+# of result dicts or a DataFrame of them
+def summarize_protocol_results(test_results):
+    df = pd.DataFrame(test_results)
+    df = df[df['lookup_time_ms'].notna()]
+
+    # Only lookups that opened a connection say anything about setup cost
+    setup = df[~df['reused_connection'].astype(bool)]
+    print("Connection setup (ms):")
+    print(setup.groupby(['dns_server', 'connection'])['connect_time_ms'].describe(percentiles=[0.5, 0.95]))
+
+    print("\nQuery round-trip (ms):")
+    print(df.groupby(['dns_server', 'connection', 'record_type'])['lookup_time_ms']
+          .describe(percentiles=[0.5, 0.95]))
+
+    print("\nTotal per lookup including setup (mean ms):")
+    df = df.assign(total_ms=df['connect_time_ms'] + df['setup_time_ms'] + df['lookup_time_ms'] + df['parse_time_ms'])
+    print(df.pivot_table(index='dns_server', columns='connection', values='total_ms'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare DNS lookup times over UDP, TCP, DoT and DoH")
+    parser.add_argument("--targets", nargs="+", help="Targets such as udp://1.1.1.1, tls://1.1.1.1:853 "
+                                                     "or https://1.1.1.1/dns-query")
+    parser.add_argument("--servers", nargs="+", default=jdns.dns_servers,
+                        help="DNS servers to test on each of --protocols when --targets is left out")
+    parser.add_argument("--protocols", nargs="+", choices=sorted(transports), default=["udp", "tcp", "tls", "https"],
+                        help="Protocols to test --servers on")
+    parser.add_argument("--websites", nargs="+", default=jdns.websites, help="Websites to look up")
+    parser.add_argument("--record-types", nargs="+", default=record_types, help="Record types to query")
+    parser.add_argument("--connections", nargs="+", choices=connection_modes, default=connection_modes,
+                        help="Connection modes to measure")
+    parser.add_argument("--num-tests", type=int, default=jdns.num_tests, help="Lookups per combination")
+    parser.add_argument("--cafile", help="CA bundle to verify TLS and HTTPS servers with")
+    parser.add_argument("--insecure", action="store_true",
+                        help="Don't verify TLS certificates, e.g. for stubdns.py's self-signed one")
+    parser.add_argument("--output", help="Stream results to this file (ndjson) or directory (arrow)")
+    parser.add_argument("--format", dest="output_format", choices=sorted(jdns.result_sinks), default="ndjson",
+                        help="Format for --output")
+    args = parser.parse_args()
+
+    targets = args.targets or expand_targets(args.servers, args.protocols)
+    sink = jdns.result_sinks[args.output_format](args.output) if args.output else None
+    try:
+        test_results = perform_protocol_tests(args.websites, targets, args.num_tests, args.record_types,
+                                              args.connections, make_client_ssl_context(args.cafile, args.insecure),
+                                              sink)
+    finally:
+        if sink:
+            sink.close()
+
+    if sink:
+        test_results = jdns.load_results_frame(args.output, args.output_format)
+    else:
+        with open("dns_protocol_results.json", "w") as f:
+            json.dump(test_results, f, indent=4)
+    summarize_protocol_results(test_results)
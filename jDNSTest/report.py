@@ -0,0 +1,196 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import jdns
+
+# Headless report for jdns results. All the statistics come from one grouped pass over the
+# DataFrame and the charts are drawn straight onto Agg canvases, so it never opens a window
+# and stays fast on millions of rows:
+#   python report.py dns_test_results.ndjson --out report/
+
+# Quantiles shown in the tables
+quantiles = [0.5, 0.95, 0.99]
+
+# Most points drawn per ECDF line, longer series are sampled at evenly spaced ranks
+ecdf_points = 2000
+
+# Heatmaps with more websites than this drop the per-row labels
+max_heatmap_labels = 60
+
+
+# Function to guess the format of a jdns output path: arrow for a directory of parts or a
+# single .arrow part, json for jdns's default .json output, ndjson for anything else
+def detect_format(path):
+    if os.path.isdir(path) or path.endswith(".arrow"):
+        return "arrow"
+    if path.endswith(".json"):
+        return "json"
+    return "ndjson"
+
+
+# Function to load results from a list of dicts, a DataFrame, or a jdns output path
+def load_results(results, output_format=None):
+    if isinstance(results, pd.DataFrame):
+        df = results
+    elif isinstance(results, str):
+        if output_format is None:
+            output_format = detect_format(results)
+        if output_format == "arrow":
+            import pyarrow as pa
+
+            if os.path.isdir(results):
+                tables = list(jdns.ArrowSink.read_tables(results))
+            else:
+                with pa.ipc.open_stream(results) as reader:
+                    tables = [reader.read_all()]
+            df = pa.concat_tables(tables, promote_options="default").to_pandas() if tables else pd.DataFrame()
+        elif output_format == "json":
+            df = pd.read_json(results)
+        else:
+            df = pd.read_json(results, lines=True)
+    else:
+        df = pd.DataFrame(results)
+
+    df = df[df["lookup_time_ms"].notna()].copy()
+    if "cache_mode" not in df:
+        df["cache_mode"] = "none"
+    # Categories make the group-bys below much cheaper than grouping on strings
+    for column in ("website", "dns_server", "cache_mode"):
+        df[column] = df[column].astype("category")
+    # Label each line of the charts by server, and by cache mode when there is more than one
+    if df["cache_mode"].nunique() > 1:
+        df["series"] = (df["dns_server"].astype(str) + " (" + df["cache_mode"].astype(str) + ")").astype("category")
+    else:
+        df["series"] = df["dns_server"]
+    return df
+
+
+# Function to compute every aggregate the report needs, grouping each key only once
+def compute_aggregates(df):
+    lookup_times = df["lookup_time_ms"]
+
+    by_pair = lookup_times.groupby([df["website"], df["series"]], observed=True)
+    pair_stats = by_pair.agg(["count", "mean"])
+    pair_stats[[f"p{int(q * 100)}" for q in quantiles]] = by_pair.quantile(quantiles).unstack()
+
+    by_series = lookup_times.groupby(df["series"], observed=True)
+    series_stats = by_series.agg(["count", "mean", "min", "max"])
+    series_quantiles = by_series.quantile(sorted({0.05, 0.25, 0.75, 0.95, *quantiles})).unstack()
+    for q in quantiles:
+        series_stats[f"p{int(q * 100)}"] = series_quantiles[q]
+
+    split_columns = [c for c in ("setup_time_ms", "lookup_time_ms", "parse_time_ms") if c in df]
+    split = df[split_columns].groupby(df["series"], observed=True).mean()
+
+    return {
+        "pairs": pair_stats,
+        "series": series_stats,
+        # Box edges: 5th/95th percentile whiskers around the quartiles
+        "boxes": series_quantiles[[0.05, 0.25, 0.5, 0.75, 0.95]],
+        "split": split,
+        "heatmap": pair_stats["p50"].unstack("series")
+    }
+
+
+def new_figure(width, height):
+    fig = Figure(figsize=(width, height))
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def plot_heatmap(heatmap, path):
+    fig = new_figure(max(6, 1.2 * len(heatmap.columns) + 3), min(40, max(4, 0.25 * len(heatmap) + 2)))
+    ax = fig.add_subplot()
+    image = ax.imshow(heatmap.to_numpy(dtype=float), aspect="auto", interpolation="nearest", cmap="viridis")
+    fig.colorbar(image, ax=ax, label="Median lookup time (ms)")
+    ax.set_xticks(range(len(heatmap.columns)), [str(c) for c in heatmap.columns], rotation=30, ha="right")
+    if len(heatmap) <= max_heatmap_labels:
+        ax.set_yticks(range(len(heatmap)), [str(i) for i in heatmap.index])
+    else:
+        ax.set_ylabel(f"{len(heatmap)} websites")
+    ax.set_title("Median DNS Lookup Time by Website and Server")
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def plot_ecdfs(df, path):
+    fig = new_figure(10, 6)
+    ax = fig.add_subplot()
+    for series, values in df["lookup_time_ms"].groupby(df["series"], observed=True):
+        values = np.sort(values.to_numpy())
+        ranks = np.arange(1, len(values) + 1) / len(values)
+        if len(values) > ecdf_points:
+            keep = np.linspace(0, len(values) - 1, ecdf_points).astype(int)
+            values, ranks = values[keep], ranks[keep]
+        ax.step(values, ranks, where="post", label=str(series))
+    ax.set_xscale("log")
+    ax.set_xlabel("Lookup Time (ms)")
+    ax.set_ylabel("Fraction of lookups")
+    ax.set_title("Lookup Time ECDF per DNS Server")
+    ax.grid(True, which="both", alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+def plot_boxplots(boxes, path):
+    # Boxes are drawn from the precomputed quantiles instead of handing matplotlib every sample
+    stats = [{"label": str(series), "whislo": row[0.05], "q1": row[0.25], "med": row[0.5],
+              "q3": row[0.75], "whishi": row[0.95], "fliers": []}
+             for series, row in boxes.iterrows()]
+    fig = new_figure(max(6, 1.2 * len(stats) + 2), 6)
+    ax = fig.add_subplot()
+    ax.bxp(stats, showfliers=False)
+    ax.set_ylabel("Lookup Time (ms)")
+    ax.set_title("Lookup Time per DNS Server (whiskers at p5/p95)")
+    ax.tick_params(axis="x", labelrotation=30)
+    fig.tight_layout()
+    fig.savefig(path, dpi=100)
+
+
+# Function to write the PNG charts and an HTML page that ties them together into out_dir
+def write_report(results, out_dir, output_format=None):
+    df = load_results(results, output_format)
+    if df.empty:
+        print("No successful lookups to report on.")
+        return None
+    aggregates = compute_aggregates(df)
+    os.makedirs(out_dir, exist_ok=True)
+
+    plot_heatmap(aggregates["heatmap"], os.path.join(out_dir, "heatmap.png"))
+    plot_ecdfs(df, os.path.join(out_dir, "ecdf.png"))
+    plot_boxplots(aggregates["boxes"], os.path.join(out_dir, "boxplot.png"))
+    aggregates["pairs"].to_csv(os.path.join(out_dir, "summary.csv"))
+
+    sections = [
+        "<h2>Per server</h2>", aggregates["series"].to_html(float_format="%.3f"),
+        "<h2>Time split (mean ms)</h2>", aggregates["split"].to_html(float_format="%.3f"),
+        '<h2>Median by website</h2><img src="heatmap.png">',
+        '<h2>Distribution</h2><img src="ecdf.png"><img src="boxplot.png">',
+        f'<p>Per-website statistics for {len(aggregates["pairs"])} website/server pairs are in '
+        '<a href="summary.csv">summary.csv</a>.</p>'
+    ]
+    page = (f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>DNS Lookup Report</title></head>"
+            f"<body><h1>DNS Lookup Report</h1><p>{len(df):,} lookups</p>"
+            + "".join(sections) + "</body></html>")
+    report_path = os.path.join(out_dir, "report.html")
+    with open(report_path, "w") as f:
+        f.write(page)
+    return report_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a headless HTML/PNG report of jdns results")
+    parser.add_argument("results", help="Results file (json/ndjson/arrow) or arrow directory")
+    parser.add_argument("--format", dest="output_format", choices=["json", *sorted(jdns.result_sinks)],
+                        help="Format of the results, guessed from the path when left out")
+    parser.add_argument("--out", default="dns_report", help="Directory to write the report to")
+    args = parser.parse_args()
+    report_path = write_report(args.results, args.out, args.output_format)
+    if report_path:
+        print(f"Report written to {report_path}")
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import base64
+import os
+import ssl
+import subprocess
+import tempfile
+import dns.exception
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+# Local stand-in DNS servers for benchmarking jdns without touching real resolvers.
+# Every query is answered with the same records after a fixed delay, over plain UDP and
+# optionally TCP, DNS-over-TLS and DNS-over-HTTPS, e.g.
+#   python stubdns.py --port 5353 --delay-ms 20
+#   python jdns.py --async --servers 127.0.0.1:5353
+#   python stubdns.py --port 5353 --tcp-port 5353 --tls-port 8853 --https-port 8443
+#   python protocols.py --insecure --targets udp://127.0.0.1:5353 tcp://127.0.0.1:5353 \
+#       tls://127.0.0.1:8853 https://127.0.0.1:8443/dns-query
+
+
+# Function to build the stub's response to a query, or None if it isn't a DNS query.
+# A query without a question gets FORMERR back, like a real server would answer
+def make_answer(data, address="127.0.0.1", ttl=300):
+    try:
+        query = dns.message.from_wire(data)
+    except dns.exception.DNSException:
+        return None
+    response = dns.message.make_response(query)
+    if not query.question:
+        response.set_rcode(dns.rcode.FORMERR)
+        return response.to_wire()
+    question = query.question[0]
+    if question.rdtype == dns.rdatatype.A:
+        response.answer.append(dns.rrset.from_text(question.name, ttl, "IN", "A", address))
+    elif question.rdtype == dns.rdatatype.AAAA:
+        response.answer.append(dns.rrset.from_text(question.name, ttl, "IN", "AAAA", "::1"))
+    elif question.rdtype == dns.rdatatype.HTTPS:
+        response.answer.append(dns.rrset.from_text(question.name, ttl, "IN", "HTTPS", '1 . alpn="h2"'))
+    return response.to_wire()
+
+
+class StubDNSProtocol(asyncio.DatagramProtocol):
+    def __init__(self, delay_ms, address, ttl):
+        self.delay = delay_ms / 1000
+        self.address = address
+        self.ttl = ttl
+        self.transport = None
+        self.queries = 0
+        # Queries received but not answered yet, and the most there have been at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        answer = make_answer(data, self.address, self.ttl)
+        if answer is None:
+            return
+        self.queries += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Answer later instead of sleeping so many queries can be pending at once
+        asyncio.get_running_loop().call_later(self.delay, self.send, answer, addr)
+
+    def send(self, data, addr):
+        self.in_flight -= 1
+        if not self.transport.is_closing():
+            self.transport.sendto(data, addr)
+
+
+# Function to start the stub server on the running loop, returns (transport, protocol)
+async def start_stub_server(host="127.0.0.1", port=5353, delay_ms=20, address="127.0.0.1", ttl=300):
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(lambda: StubDNSProtocol(delay_ms, address, ttl),
+                                               local_addr=(host, port))
+
+
+# Function to start a DNS-over-TCP stub, or DNS-over-TLS when given an SSL context.
+# Messages are framed with a two-byte length and a connection can carry many queries
+async def start_stream_server(host="127.0.0.1", port=5353, delay_ms=20, ssl_context=None,
+                              address="127.0.0.1", ttl=300):
+    async def handle(reader, writer):
+        try:
+            while True:
+                size = int.from_bytes(await reader.readexactly(2), "big")
+                answer = make_answer(await reader.readexactly(size), address, ttl)
+                if answer is None:
+                    break
+                await asyncio.sleep(delay_ms / 1000)
+                writer.write(len(answer).to_bytes(2, "big") + answer)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, ssl=ssl_context)
+
+
+# Function to start a DNS-over-HTTPS stub (RFC 8484 POST and GET), or plain HTTP without an
+# SSL context. Connections are kept alive until the client closes them
+async def start_doh_server(host="127.0.0.1", port=8443, delay_ms=20, ssl_context=None,
+                           address="127.0.0.1", ttl=300):
+    async def handle(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if method == "POST":
+                    data = await reader.readexactly(int(headers.get("content-length", 0)))
+                else:
+                    encoded = target.partition("dns=")[2].split("&")[0]
+                    data = base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+                answer = make_answer(data, address, ttl)
+                await asyncio.sleep(delay_ms / 1000)
+                if answer is None:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/dns-message\r\n"
+                                 + f"Content-Length: {len(answer)}\r\n\r\n".encode() + answer)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, ssl=ssl_context)
+
+
+# Function to build a server SSL context. Without a certificate a throwaway self-signed one
+# is made with the openssl command, so clients need to skip verification (--insecure)
+def make_server_ssl_context(certfile=None, keyfile=None):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    if certfile:
+        context.load_cert_chain(certfile, keyfile)
+        return context
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+                       check=True, capture_output=True)
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+async def serve(args):
+    transport, protocol = await start_stub_server(args.host, args.port, args.delay_ms)
+    servers = []
+    print(f"Stub DNS server listening on udp://{args.host}:{args.port} with {args.delay_ms} ms delay")
+    if args.tcp_port:
+        servers.append(await start_stream_server(args.host, args.tcp_port, args.delay_ms))
+        print(f"Also on tcp://{args.host}:{args.tcp_port}")
+    if args.tls_port or args.https_port:
+        ssl_context = make_server_ssl_context(args.certfile, args.keyfile)
+        if args.tls_port:
+            servers.append(await start_stream_server(args.host, args.tls_port, args.delay_ms, ssl_context))
+            print(f"Also on tls://{args.host}:{args.tls_port}")
+        if args.https_port:
+            servers.append(await start_doh_server(args.host, args.https_port, args.delay_ms, ssl_context))
+            print(f"Also on https://{args.host}:{args.https_port}/dns-query")
+    if args.http_port:
+        servers.append(await start_doh_server(args.host, args.http_port, args.delay_ms))
+        print(f"Also on http://{args.host}:{args.http_port}/dns-query")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+        for server in servers:
+            server.close()
+        print(f"Answered {protocol.queries} UDP queries")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub DNS server that answers after a fixed delay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5353, help="UDP port")
+    parser.add_argument("--delay-ms", type=float, default=20)
+    parser.add_argument("--tcp-port", type=int, help="Also serve DNS over TCP on this port")
+    parser.add_argument("--tls-port", type=int, help="Also serve DNS over TLS on this port")
+    parser.add_argument("--https-port", type=int, help="Also serve DNS over HTTPS on this port")
+    parser.add_argument("--http-port", type=int, help="Also serve DoH without TLS on this port")
+    parser.add_argument("--certfile", help="TLS certificate, a self-signed one is made when left out")
+    parser.add_argument("--keyfile", help="TLS private key for --certfile")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
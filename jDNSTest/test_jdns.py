@@ -0,0 +1,69 @@
+import asyncio
+import math
+import threading
+import time
+import unittest
+
+import jdns
+import stubdns
+
+# Runs jdns against stubdns.py's local stub server, so no real resolver is needed:
+#   python -m unittest test_jdns
+
+# Milliseconds the stub waits before every answer
+DELAY_MS = 50
+
+
+class StubServer:
+    """stubdns.start_stub_server on an ephemeral port, run on its own thread so the
+    blocking perform_tests can use it too."""
+
+    def __init__(self, delay_ms=DELAY_MS):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        start = stubdns.start_stub_server(port=0, delay_ms=delay_ms)
+        self.transport, self.protocol = asyncio.run_coroutine_threadsafe(start, self.loop).result()
+        host, port = self.transport.get_extra_info("sockname")[:2]
+        self.address = f"{host}:{port}"
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class PerformTestsAsyncTest(unittest.TestCase):
+    websites = ["a.example", "b.example"]
+    num_tests = 4
+    per_server_limit = 2
+
+    def setUp(self):
+        self.stub = StubServer()
+        self.addCleanup(self.stub.close)
+
+    def run_async(self):
+        start = time.perf_counter()
+        results = asyncio.run(jdns.perform_tests_async(self.websites, [self.stub.address], self.num_tests,
+                                                       max_in_flight=50, per_server_limit=self.per_server_limit))
+        return results, time.perf_counter() - start
+
+    def test_matches_sequential_results(self):
+        expected = jdns.perform_tests(self.websites, [self.stub.address], self.num_tests)
+        results, _ = self.run_async()
+        self.assertEqual([list(result) for result in results], [list(result) for result in expected])
+        self.assertEqual([(r["website"], r["dns_server"], r["test_number"]) for r in results],
+                         [(r["website"], r["dns_server"], r["test_number"]) for r in expected])
+        self.assertTrue(all(result["lookup_time_ms"] is not None for result in results))
+
+    def test_respects_per_server_limit(self):
+        results, elapsed = self.run_async()
+        self.assertEqual(self.stub.protocol.queries, len(results))
+        self.assertLessEqual(self.stub.protocol.max_in_flight, self.per_server_limit)
+
+        # The lookups go out per_server_limit at a time, each batch waiting out the delay once
+        expected = math.ceil(len(results) / self.per_server_limit) * DELAY_MS / 1000
+        self.assertGreaterEqual(elapsed, expected * 0.9)
+        self.assertLess(elapsed, expected + 0.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import cv2
+
+import steg
+
+# Headless batch mode for jSteg. Every image under a directory is processed by a pool of
+# worker processes and each result is printed as one JSON line as soon as it is done:
+#   python batch.py capacity photos/
+#   python batch.py embed photos/ marked/ --message "(c) ACME {name}"
+#   python batch.py extract marked/ > messages.ndjson
+# {name} in the message is replaced by each image's file name without its extension.
+
+
+def find_images(directory):
+    """Yield every image under directory as a path relative to it, in a stable order."""
+    for root, dirs, filenames in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(steg.IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, filename), directory)
+
+
+def init_worker():
+    # One OpenCV thread per process, the pool already keeps every core busy
+    cv2.setNumThreads(1)
+
+
+def embed_job(job):
+    source, destination, message, mode, codec, ecc_symbols, density = job
+    start = time.perf_counter()
+    try:
+        image = steg.read_image(source)
+        capacity = steg.capacity(image.shape, mode, density)
+        marked = steg.hide_message(image, message, mode, codec, ecc_symbols, density)
+        if marked is None:
+            raise ValueError(f'message is empty or does not fit, the image holds {capacity} bytes '
+                             f'after compression')
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        steg.write_image(destination, marked)
+    except Exception as e:
+        return {'image': source, 'ok': False, 'error': str(e)}
+    return {'image': source, 'ok': True, 'output': destination, 'capacity': capacity,
+            'pixels': image.shape[0] * image.shape[1], 'seconds': time.perf_counter() - start}
+
+
+def extract_job(job):
+    source, mode = job
+    start = time.perf_counter()
+    try:
+        image = steg.read_image(source)
+        message = steg.extract_message(image, mode)
+    except Exception as e:
+        return {'image': source, 'ok': False, 'error': str(e)}
+    return {'image': source, 'ok': True, 'message': message, 'pixels': image.shape[0] * image.shape[1],
+            'seconds': time.perf_counter() - start}
+
+
+def capacity_job(source):
+    try:
+        height, width = steg.read_image(source).shape[:2]
+    except Exception as e:
+        return {'image': source, 'ok': False, 'error': str(e)}
+    return {'image': source, 'ok': True, 'width': width, 'height': height, 'pixels': width * height,
+            **{f'{mode}_capacity': steg.capacity((height, width), mode) for mode in steg.MODES}}
+
+
+def embed_jobs(input_dir, output_dir, message, extension, skip_existing, mode, codec, ecc_symbols, density):
+    for path in find_images(input_dir):
+        stem = os.path.splitext(path)[0]
+        destination = os.path.join(output_dir, stem + extension)
+        if skip_existing and os.path.exists(destination):
+            continue
+        yield (os.path.join(input_dir, path), destination, message.replace('{name}', os.path.basename(stem)), mode,
+               codec, ecc_symbols, density)
+
+
+def run_pool(job, jobs, processes=None, chunksize=4):
+    """Run job over jobs in a process pool, yielding results in completion order."""
+    with Pool(processes, initializer=init_worker) as pool:
+        yield from pool.imap_unordered(job, jobs, chunksize)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hide or read messages in every image in a directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    embed = subparsers.add_parser('embed', help='Hide a message in every image')
+    embed.add_argument('input', help='Directory of images')
+    embed.add_argument('output', help='Directory to write the marked images to, keeping the layout')
+    embed.add_argument('--message', required=True, help='Message to hide, {name} becomes the file name')
+    embed.add_argument('--ext', default='.png', help='Output image format, full mode needs a lossless one '
+                                                     '(default .png)')
+    embed.add_argument('--skip-existing', action='store_true', help='Leave images already in output alone')
+    embed.add_argument('--mode', choices=steg.MODES, default='block', help='How the message is hidden')
+    steg.add_payload_arguments(embed)
+
+    extract = subparsers.add_parser('extract', help='Read the message hidden in every image')
+    extract.add_argument('input', help='Directory of images')
+    extract.add_argument('--mode', choices=steg.MODES, help='How the message was hidden (default: try each)')
+
+    capacity = subparsers.add_parser('capacity', help='Report how many bytes every image can hold')
+    capacity.add_argument('input', help='Directory of images')
+
+    for sub in (embed, extract, capacity):
+        sub.add_argument('--processes', type=int, help='Worker processes (default: one per core)')
+        sub.add_argument('--chunksize', type=int, default=4, help='Images handed to a worker at a time')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'embed':
+        extension = args.ext if args.ext.startswith('.') else '.' + args.ext
+        jobs = embed_jobs(args.input, args.output, args.message, extension, args.skip_existing, args.mode,
+                          args.codec, args.ecc, args.density)
+        results = run_pool(embed_job, jobs, args.processes, args.chunksize)
+    elif args.command == 'extract':
+        jobs = ((os.path.join(args.input, path), args.mode) for path in find_images(args.input))
+        results = run_pool(extract_job, jobs, args.processes, args.chunksize)
+    else:
+        jobs = (os.path.join(args.input, path) for path in find_images(args.input))
+        results = run_pool(capacity_job, jobs, args.processes, args.chunksize)
+
+    start = time.perf_counter()
+    done = failed = pixels = 0
+    for result in results:
+        print(json.dumps(result), flush=True)
+        done += 1
+        failed += not result['ok']
+        pixels += result.get('pixels', 0)
+    elapsed = time.perf_counter() - start
+    print(f'{done} images in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.2f} images/s, '
+          f'{pixels / 1e6 / elapsed if elapsed else 0:.1f} MP/s), {failed} failed', file=sys.stderr)
@@ -1,16 +1,134 @@
 import sys
 import numpy as np
 import cv2
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QVBoxLayout,
-                             QWidget, QPushButton, QFileDialog, QTextEdit)
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QLabel, QVBoxLayout, QHBoxLayout,
+                             QWidget, QPushButton, QFileDialog, QTextEdit, QProgressBar)
 from PyQt5.QtGui import QPixmap, QImage
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+
+import steg
+import tiled
+
+# Width the preview is shown at until the user zooms
+PREVIEW_WIDTH = 600
+
+# Each zoom step scales the preview by this much
+ZOOM_STEP = 1.25
+
+# The smallest level of the preview pyramid is at most this wide
+PYRAMID_MIN_WIDTH = 256
+
+# Scaled previews kept per image, so zooming back and forth is instant
+PREVIEW_CACHE_SIZE = 8
+
+
+class PreviewPyramid:
+    """Halved copies of an image, built once, so previews are scaled from the nearest level
+    instead of the full resolution original."""
+
+    def __init__(self, image):
+        self.levels = [image]
+        while self.levels[-1].shape[1] // 2 >= PYRAMID_MIN_WIDTH:
+            self.levels.append(cv2.pyrDown(self.levels[-1]))
+        self.cache = {}
+
+    @property
+    def width(self):
+        return self.levels[0].shape[1]
+
+    def scaled(self, width):
+        if width not in self.cache:
+            if len(self.cache) >= PREVIEW_CACHE_SIZE:
+                self.cache.pop(next(iter(self.cache)))
+            # Smallest level that is still at least as wide as the preview
+            level = next((level for level in reversed(self.levels) if level.shape[1] >= width), self.levels[0])
+            height = round(level.shape[0] * width / level.shape[1])
+            interpolation = cv2.INTER_AREA if level.shape[1] > width else cv2.INTER_LINEAR
+            self.cache[width] = cv2.resize(level, (width, height), interpolation=interpolation)
+        return self.cache[width]
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs fn(*args, progress=...) on the thread pool and reports back through signals.
+
+    Cancelling takes effect the next time fn reports progress.
+    """
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = WorkerSignals()
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def report(self, fraction):
+        if self.is_cancelled:
+            raise Cancelled()
+        self.signals.progress.emit(int(fraction * 100))
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, progress=self.report)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.finished.emit(result)
+
+
+def load_image(fileName, progress=None):
+    image = steg.read_image(fileName)
+    if progress:
+        progress(0.5)
+    return image, PreviewPyramid(image)
+
+
+def save_image(image, message, fileName, progress=None):
+    marked = hide_message(image, message, progress)
+    if marked is None:
+        raise ValueError('The message is empty or does not fit in the image')
+    steg.write_image(fileName, marked)
+    return PreviewPyramid(marked)
+
+
+def hide_message(image, message, progress=None):
+    marked = np.empty_like(image)
+    memory_budget = tiled.DEFAULT_MEMORY_MB * 1024 * 1024
+    if not tiled.hide_message_tiled(image, marked, message, memory_budget, progress=progress):
+        return None
+    return marked
+
+
+def extract_message(image, progress=None):
+    message = tiled.extract_message_tiled(image, tiled.DEFAULT_MEMORY_MB * 1024 * 1024, progress=progress)
+    if message is None:
+        if progress:
+            progress(0)  # last chance to cancel before the full mode search
+        message = steg.extract_message_full(image)
+    return message
 
 
 class SteganographyApp(QMainWindow):
     def __init__(self):
         super().__init__()
 
+        self.threadPool = QThreadPool.globalInstance()
+        self.worker = None
         self.initUI()
 
     def initUI(self):
@@ -25,6 +143,15 @@ class SteganographyApp(QMainWindow):
         self.imageLabel.setAlignment(Qt.AlignCenter)
         self.layout.addWidget(self.imageLabel)
 
+        zoomLayout = QHBoxLayout()
+        self.zoomOutButton = QPushButton('Zoom Out', self)
+        self.zoomOutButton.clicked.connect(lambda: self.zoom(1 / ZOOM_STEP))
+        zoomLayout.addWidget(self.zoomOutButton)
+        self.zoomInButton = QPushButton('Zoom In', self)
+        self.zoomInButton.clicked.connect(lambda: self.zoom(ZOOM_STEP))
+        zoomLayout.addWidget(self.zoomInButton)
+        self.layout.addLayout(zoomLayout)
+
         self.textEdit = QTextEdit(self)
         self.textEdit.setPlaceholderText('Enter the message to hide...')
         self.layout.addWidget(self.textEdit)
@@ -41,108 +168,110 @@ class SteganographyApp(QMainWindow):
         self.extractButton.clicked.connect(self.extractMessage)
         self.layout.addWidget(self.extractButton)
 
+        progressLayout = QHBoxLayout()
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        progressLayout.addWidget(self.progressBar)
+        self.cancelButton = QPushButton('Cancel', self)
+        self.cancelButton.clicked.connect(self.cancelWork)
+        progressLayout.addWidget(self.cancelButton)
+        self.layout.addLayout(progressLayout)
+        self.statusLabel = QLabel(self)
+        self.layout.addWidget(self.statusLabel)
+
         self.image = None
+        self.preview = None
+        self.previewWidth = PREVIEW_WIDTH
+        self.setBusy(False)
+
+    def setBusy(self, busy):
+        for button in (self.loadButton, self.saveButton, self.extractButton):
+            button.setEnabled(not busy)
+        self.cancelButton.setEnabled(busy)
+        self.progressBar.setVisible(busy)
+        self.cancelButton.setVisible(busy)
+
+    def startWork(self, status, onFinished, fn, *args):
+        """Run fn on the thread pool, the UI stays responsive and shows its progress."""
+        self.worker = Worker(fn, *args)
+        self.worker.signals.progress.connect(self.progressBar.setValue)
+        self.worker.signals.finished.connect(lambda result: self.workDone(onFinished, result))
+        self.worker.signals.failed.connect(lambda error: self.workDone(None, None, f'Failed: {error}'))
+        self.worker.signals.cancelled.connect(lambda: self.workDone(None, None, 'Cancelled.'))
+        self.progressBar.setValue(0)
+        self.statusLabel.setText(status)
+        self.setBusy(True)
+        self.threadPool.start(self.worker)
+
+    def workDone(self, onFinished, result, status=''):
+        self.worker = None
+        self.setBusy(False)
+        self.statusLabel.setText(status)
+        if onFinished:
+            onFinished(result)
+
+    def cancelWork(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.statusLabel.setText('Cancelling...')
 
     def loadImage(self):
         options = QFileDialog.Options()
         fileName, _ = QFileDialog.getOpenFileName(self, "Open Image File", "",
                                                   "Images (*.png *.jpg *.bmp)", options=options)
         if fileName:
-            self.image = cv2.imread(fileName)
-            self.displayImage(self.image)
+            self.startWork('Loading...', self.imageLoaded, load_image, fileName)
+
+    def imageLoaded(self, result):
+        self.image, self.preview = result
+        self.previewWidth = min(PREVIEW_WIDTH, self.preview.width)
+        self.displayImage()
+        self.textEdit.setPlaceholderText(
+            f'Enter the message to hide (up to {steg.capacity(self.image.shape)} bytes once compressed)...')
 
-    def displayImage(self, image):
-        scaled_image = self.scaleImage(image, width=600)
+    def displayImage(self):
+        scaled_image = self.preview.scaled(self.previewWidth)
         qformat = QImage.Format_RGB888
         img = QImage(scaled_image, scaled_image.shape[1], scaled_image.shape[0], scaled_image.strides[0], qformat)
         img = img.rgbSwapped()
         self.imageLabel.setPixmap(QPixmap.fromImage(img))
 
-    def scaleImage(self, image, width=None, height=None):
-        dim = None
-        (h, w) = image.shape[:2]
-
-        if width is None and height is None:
-            return image
-        if width is None:
-            r = height / float(h)
-            dim = (int(w * r), height)
-        else:
-            r = width / float(w)
-            dim = (width, int(h * r))
-
-        scaled = cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
-        return scaled
+    def zoom(self, factor):
+        if self.preview is not None:
+            self.previewWidth = max(PYRAMID_MIN_WIDTH // 2, min(self.preview.width, round(self.previewWidth * factor)))
+            self.displayImage()
 
     def saveImage(self):
         if self.image is not None:
             message = self.textEdit.toPlainText()
-            image_with_message = self.hideMessageInImage(self.image, message)
-            if image_with_message is not None:
-                options = QFileDialog.Options()
-                fileName, _ = QFileDialog.getSaveFileName(self, "Save Image File", "",
-                                                          "Images (*.png *.jpg *.bmp)", options=options)
-                if fileName:
-                    cv2.imwrite(fileName, image_with_message)
-                    self.displayImage(image_with_message)
-
-    def hideMessageInImage(self, image, message):
-        if not message:
-            return None
-
-        # Convert the image to YCbCr color space
-        ycbcr = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
-        y, cb, cr = cv2.split(ycbcr)
-
-        # Apply DCT to the Y channel
-        dct = cv2.dct(np.float32(y))
+            if not message:
+                self.statusLabel.setText('Enter a message to hide first.')
+                return
+            options = QFileDialog.Options()
+            fileName, _ = QFileDialog.getSaveFileName(self, "Save Image File", "",
+                                                      "Images (*.png *.jpg *.bmp)", options=options)
+            if fileName:
+                self.startWork('Hiding message...', self.imageSaved, save_image, self.image, message, fileName)
 
-        # Embed the message into the DCT coefficients
-        message += chr(0)  # Append a null character to denote end of message
-        msg_index = 0
-        msg_len = len(message)
+    def imageSaved(self, preview):
+        self.preview = preview
+        self.displayImage()
 
-        for i in range(dct.shape[0]):
-            for j in range(dct.shape[1]):
-                if msg_index < msg_len:
-                    dct[i, j] = ord(message[msg_index])
-                    msg_index += 1
-                else:
-                    break
-
-        # Perform inverse DCT to get the Y channel back
-        y = cv2.idct(dct).clip(0, 255).astype(np.uint8)
-
-        # Merge the channels and convert back to BGR color space
-        ycbcr = cv2.merge([y, cb, cr])
-        image_with_message = cv2.cvtColor(ycbcr, cv2.COLOR_YCrCb2BGR)
-        return image_with_message
+    def hideMessageInImage(self, image, message):
+        return hide_message(image, message)
 
     def extractMessage(self):
         if self.image is not None:
-            hidden_message = self.extractMessageFromImage(self.image)
-            if hidden_message:
-                self.textEdit.setText(hidden_message)
-            else:
-                self.textEdit.setText('No hidden message found.')
+            self.startWork('Extracting message...', self.messageExtracted, extract_message, self.image)
+
+    def messageExtracted(self, hidden_message):
+        if hidden_message:
+            self.textEdit.setText(hidden_message)
+        else:
+            self.textEdit.setText('No hidden message found.')
 
     def extractMessageFromImage(self, image):
-        # Convert the image to YCbCr color space
-        ycbcr = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
-        y, _, _ = cv2.split(ycbcr)
-
-        # Apply DCT to the Y channel
-        dct = cv2.dct(np.float32(y))
-
-        # Extract the message from the DCT coefficients
-        message = ''
-        for i in range(dct.shape[0]):
-            for j in range(dct.shape[1]):
-                char = chr(int(dct[i, j]))
-                if char == chr(0):  # Null character denotes end of message
-                    return message
-                message += char
-        return None
+        return extract_message(image)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+import lzma
+import struct
+import zlib
+from collections import namedtuple
+
+# Binary framing for hidden messages. A frame is a fixed size header followed by the body:
+#   magic "jS" | version | codec | ECC symbols | bits per coefficient | body length | message CRC32 | header CRC32
+# The body is the UTF-8 message, compressed with the codec and, when ECC symbols is non-zero,
+# Reed-Solomon encoded (needs the reedsolo package). The header's own CRC lets extraction
+# give up after reading HEADER_SIZE bytes when an image holds no message.
+
+MAGIC = b'jS'
+VERSION = 1
+
+CODECS = ['none', 'zlib', 'lzma']
+
+# Largest LZMA dictionary, messages are compressed with the smallest power of two that holds them
+# so a short message doesn't allocate hundreds of MB of encoder state. Raw LZMA2 doesn't record
+# it, so the decoder is always given this size
+LZMA_DICT_MAX = 1 << 23
+
+HEADER = struct.Struct('>2sBBBBII')
+HEADER_SIZE = HEADER.size + 4
+
+Header = namedtuple('Header', ['codec', 'ecc_symbols', 'density', 'length', 'crc'])
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def compress(data, codec):
+    if codec == 'zlib':
+        return zlib.compress(data, 9)
+    if codec == 'lzma':
+        dict_size = min(LZMA_DICT_MAX, max(1 << 12, 1 << (len(data) - 1).bit_length()))
+        return lzma.compress(data, format=lzma.FORMAT_RAW,
+                             filters=[{'id': lzma.FILTER_LZMA2, 'preset': 9, 'dict_size': dict_size}])
+    return data
+
+
+def decompress(data, codec):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data, format=lzma.FORMAT_RAW,
+                               filters=[{'id': lzma.FILTER_LZMA2, 'dict_size': LZMA_DICT_MAX}])
+    return data
+
+
+def rs_codec(ecc_symbols):
+    try:
+        import reedsolo
+    except ImportError:
+        raise ImportError('Error correction needs the reedsolo package (pip install reedsolo)') from None
+    return reedsolo.RSCodec(ecc_symbols), reedsolo.ReedSolomonError
+
+
+def pack(message, codec='auto', ecc_symbols=0, density=1):
+    """Frame a message, returns the header and body as one bytes object.
+
+    codec 'auto' keeps whichever of the codecs gives the smallest body. density is stored for
+    the embedder, the number of bits it puts in each coefficient.
+    """
+    data = message.encode('utf-8')
+    if codec == 'auto':
+        codec, body = min(((name, compress(data, name)) for name in CODECS), key=lambda option: len(option[1]))
+    else:
+        body = compress(data, codec)
+    if ecc_symbols:
+        body = bytes(rs_codec(ecc_symbols)[0].encode(body))
+    fields = HEADER.pack(MAGIC, VERSION, CODECS.index(codec), ecc_symbols, density, len(body), zlib.crc32(data))
+    return fields + struct.pack('>I', zlib.crc32(fields)) + body
+
+
+def read_header(data):
+    """Parse the first HEADER_SIZE bytes of a frame, returns None when they aren't a valid header."""
+    if len(data) < HEADER_SIZE:
+        return None
+    fields, (crc,) = data[:HEADER.size], struct.unpack('>I', data[HEADER.size:HEADER_SIZE])
+    magic, version, codec, ecc_symbols, density, length, message_crc = HEADER.unpack(fields)
+    if magic != MAGIC or version != VERSION or zlib.crc32(fields) != crc or codec >= len(CODECS):
+        return None
+    return Header(CODECS[codec], ecc_symbols, density, length, message_crc)
+
+
+def unpack(header, body):
+    """Recover the message from a frame's body, raises PayloadError if it is damaged."""
+    if header.ecc_symbols:
+        codec, error = rs_codec(header.ecc_symbols)
+        try:
+            body = bytes(codec.decode(body)[0])
+        except error as e:
+            raise PayloadError(f'Too many errors to correct: {e}') from None
+    try:
+        data = decompress(body, header.codec)
+    except (zlib.error, lzma.LZMAError) as e:
+        raise PayloadError(f'Could not decompress the message: {e}') from None
+    if zlib.crc32(data) != header.crc:
+        raise PayloadError('The message failed its CRC check')
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise PayloadError('The message is not valid UTF-8') from None
@@ -0,0 +1,333 @@
+import math
+
+import cv2
+import numpy as np
+
+import payload
+
+# DCT steganography without any GUI, shared by the jsteg.py window and the batch CLI.
+# Two modes are supported:
+#   block  JPEG-style 8x8 block DCT of the luma (Y) channel, bits set in mid-frequency
+#          coefficients with quantization index modulation (QIM). All blocks are transformed
+#          at once with matrix products and only the blocks the message needs are touched, so
+#          it is fast on large images, hard to see and survives saving as a good quality .jpg
+#   full   the original scheme's full-frame DCT of the luma channel, with bits set in its
+#          coefficients the same way. Only survives lossless formats
+# Either way the message is framed by payload.py: compressed, CRC checked and optionally
+# protected by Reed-Solomon, behind a header that says exactly how much to read.
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+BLOCK_SIZE = 8
+
+# (row, column) of the coefficients in each block that carry a bit, in the middle band: low
+# enough to survive JPEG quantization, high enough not to show as blotches
+BLOCK_POSITIONS = [(1, 2), (2, 1), (2, 2), (1, 3), (3, 1)]
+
+# QIM step. With one bit per coefficient, a coefficient is moved to the nearest multiple of
+# QIM_STEP (bit 0) or the nearest odd multiple of QIM_STEP / 2 (bit 1); with n bits it is moved
+# onto one of 2 ** n lattices QIM_STEP / 2 ** n apart. Larger steps survive harsher JPEG at the
+# cost of more noise, more bits per coefficient hold more but survive less
+QIM_STEP = 24
+
+# Most bits a message body can put in one coefficient, with 4 the lattices are so close that
+# rounding back to 8-bit BGR alone flips symbols
+MAX_DENSITY = 3
+
+# The frame header always goes one bit per coefficient, so it can be read before its density is known
+HEADER_SLOTS = payload.HEADER_SIZE * 8
+
+MODES = ['block', 'full']
+
+# Full mode slots skip the DC coefficient, the image's mean brightness, and step FULL_STRIDE
+# coefficients at a time through the rest. Consecutive slots in one row of the DCT would change
+# every row of pixels alike, and rounding back to 8 bits would then pile up on exactly those slots
+FULL_STRIDE = 7919
+
+# Times a message is re-embedded, pushing each coefficient that came back wrong past its target
+# by however far the trip back to 8-bit BGR moved it, to win back symbols lost to clipped colors
+MARK_PASSES = 8
+
+
+def dct_matrix(n=BLOCK_SIZE):
+    """Orthonormal DCT-II matrix, blocks are transformed with D @ block @ D.T like JPEG does."""
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+DCT_MATRIX = dct_matrix()
+
+
+def slot_capacity(slots, density):
+    return max(0, (slots - HEADER_SLOTS) * density // 8)
+
+
+def block_capacity(shape, density=1):
+    """Bytes of frame body a block mode image of this (height, width, ...) shape can hold."""
+    return slot_capacity((shape[0] // BLOCK_SIZE) * (shape[1] // BLOCK_SIZE) * len(BLOCK_POSITIONS), density)
+
+
+def full_capacity(shape, density=1):
+    """Bytes of frame body a full mode image can hold."""
+    return slot_capacity(shape[0] * shape[1] - 1, density)
+
+
+def capacity(shape, mode='block', density=1):
+    """Bytes of frame body an image can hold, about the message size before compression and ECC."""
+    return block_capacity(shape, density) if mode == 'block' else full_capacity(shape, density)
+
+
+def fits(frame, shape, mode='block', density=1):
+    return len(frame) - payload.HEADER_SIZE <= capacity(shape, mode, density)
+
+
+def luma_blocks(y, count):
+    """Return the DCT of the first `count` 8x8 blocks of y in row-major order.
+
+    Whole rows of blocks are transformed, so the result can hold a few more than `count`.
+    """
+    blocks_across = y.shape[1] // BLOCK_SIZE
+    rows = -(-count // blocks_across)
+    region = y[:rows * BLOCK_SIZE, :blocks_across * BLOCK_SIZE].astype(np.float32)
+    blocks = region.reshape(rows, BLOCK_SIZE, blocks_across, BLOCK_SIZE).swapaxes(1, 2)
+    return DCT_MATRIX @ blocks.reshape(-1, BLOCK_SIZE, BLOCK_SIZE) @ DCT_MATRIX.T
+
+
+def bytes_to_symbols(data, density):
+    """Split bytes into density-bit symbols, most significant bits first."""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    bits = np.concatenate([bits, np.zeros(-len(bits) % density, dtype=np.uint8)]).reshape(-1, density)
+    return (bits << np.arange(density - 1, -1, -1, dtype=np.uint8)).sum(axis=1).astype(np.uint8)
+
+
+def symbols_to_bytes(symbols, density, length):
+    """Join density-bit symbols back into length bytes."""
+    bits = (symbols[:, None] >> np.arange(density - 1, -1, -1, dtype=np.uint8)) & 1
+    return np.packbits(bits.reshape(-1)[:length * 8]).tobytes()
+
+
+def body_slots(length, density):
+    return -(-length * 8 // density)
+
+
+def slot_levels(count, density):
+    """QIM levels of the first count slots, the header's 2 and then 2 ** density for the body."""
+    levels = np.full(count, 1 << density, dtype=np.int64)
+    levels[:HEADER_SLOTS] = 2
+    return levels
+
+
+def frame_symbols(frame, density):
+    """Return the QIM symbols and levels that carry a payload.pack frame."""
+    header = bytes_to_symbols(frame[:payload.HEADER_SIZE], 1)
+    body = bytes_to_symbols(frame[payload.HEADER_SIZE:], density) if len(frame) > payload.HEADER_SIZE else []
+    symbols = np.concatenate([header, body]).astype(np.uint8)
+    return symbols, slot_levels(len(symbols), density)
+
+
+def read_frame(read_symbols, shape, mode='block'):
+    """Read a frame through read_symbols(count, levels), which returns the first count symbols.
+
+    Returns the message, None when there is no valid header, and raises payload.PayloadError
+    when the header is valid but the body is damaged.
+    """
+    header = payload.read_header(symbols_to_bytes(read_symbols(HEADER_SLOTS, 2), 1, payload.HEADER_SIZE))
+    if header is None or not 1 <= header.density <= MAX_DENSITY:
+        return None
+    if header.length > capacity(shape, mode, header.density):
+        return None
+    count = HEADER_SLOTS + body_slots(header.length, header.density)
+    symbols = read_symbols(count, slot_levels(count, header.density))[HEADER_SLOTS:]
+    return payload.unpack(header, symbols_to_bytes(symbols, header.density, header.length))
+
+
+def qim_read(coefficients, levels):
+    return (np.round(coefficients * levels / QIM_STEP).astype(np.int64) % levels).astype(np.uint8)
+
+
+def qim_write(coefficients, symbols, levels):
+    """Move each coefficient onto the nearest point of the lattice for its symbol."""
+    offset = symbols * QIM_STEP / levels
+    return np.round((coefficients - offset) / QIM_STEP) * QIM_STEP + offset
+
+
+def read_block_coefficients(y, count):
+    """Return the first count carrying coefficients of the luma channel y."""
+    positions = tuple(zip(*BLOCK_POSITIONS))
+    blocks = luma_blocks(y, -(-count // len(BLOCK_POSITIONS)))
+    return blocks[:, positions[0], positions[1]].reshape(-1)[:count]
+
+
+def read_block_symbols(y, count, levels=2):
+    """Read the first count QIM symbols of the luma channel y, each with its number of levels."""
+    return qim_read(read_block_coefficients(y, count), levels)
+
+
+def write_block_coefficients(y, values):
+    """Set the first len(values) carrying coefficients of the luma channel y in place."""
+    positions = tuple(zip(*BLOCK_POSITIONS))
+    blocks = luma_blocks(y, -(-len(values) // len(BLOCK_POSITIONS)))
+    coefficients = blocks[:, positions[0], positions[1]].reshape(-1)
+    coefficients[:len(values)] = values
+    blocks[:, positions[0], positions[1]] = coefficients.reshape(len(blocks), -1)
+
+    # Back to pixels, only the block rows that were transformed change
+    blocks_across = y.shape[1] // BLOCK_SIZE
+    rows = len(blocks) // blocks_across
+    pixels = (DCT_MATRIX.T @ blocks @ DCT_MATRIX).reshape(rows, blocks_across, BLOCK_SIZE, BLOCK_SIZE)
+    pixels = pixels.swapaxes(1, 2).reshape(rows * BLOCK_SIZE, blocks_across * BLOCK_SIZE)
+    y[:pixels.shape[0], :pixels.shape[1]] = np.clip(np.round(pixels), 0, 255)
+
+
+def mark_blocks(image, symbols, levels, to_ycrcb=cv2.COLOR_BGR2YCrCb, from_ycrcb=cv2.COLOR_YCrCb2BGR):
+    """Return a copy of image with QIM symbols hidden from its first 8x8 block on.
+
+    Like full mode, coefficients that the trip back to 8-bit color moves off their lattice are
+    pushed further over, for up to MARK_PASSES passes. Only the block rows holding symbols are converted.
+    """
+    blocks_across = image.shape[1] // BLOCK_SIZE
+    rows = -(-len(symbols) // (len(BLOCK_POSITIONS) * blocks_across)) * BLOCK_SIZE
+    ycbcr = cv2.cvtColor(np.ascontiguousarray(image[:rows]), to_ycrcb)
+    target = qim_write(read_block_coefficients(ycbcr[:, :, 0], len(symbols)), symbols, levels)
+    written = target.copy()
+    for _ in range(MARK_PASSES):
+        marked = ycbcr.copy()
+        write_block_coefficients(marked[:, :, 0], written)
+        marked = cv2.cvtColor(marked, from_ycrcb)
+        survived = read_block_coefficients(cv2.cvtColor(marked, to_ycrcb)[:, :, 0], len(symbols))
+        wrong = qim_read(survived, levels) != symbols
+        if not wrong.any():
+            break
+        written[wrong] += (target - survived)[wrong]
+    result = np.array(image)
+    result[:rows] = marked
+    return result
+
+
+def hide_message_blocks(image, message, codec='auto', ecc_symbols=0, density=1):
+    """Block mode hide_message, see hide_message."""
+    if not message or not 1 <= density <= MAX_DENSITY:
+        return None
+    frame = payload.pack(message, codec, ecc_symbols, density)
+    if not fits(frame, image.shape, 'block', density):
+        return None
+    return mark_blocks(image, *frame_symbols(frame, density))
+
+
+def extract_message_blocks(image):
+    """Block mode extract_message, see extract_message."""
+    y = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)[:, :, 0]
+    if block_capacity(y.shape) == 0:
+        return None
+    return read_frame(lambda count, levels: read_block_symbols(y, count, levels), y.shape)
+
+
+def full_slots(size, count):
+    """Flat indices of the first count full mode slots of a DCT with size coefficients."""
+    stride = FULL_STRIDE
+    while math.gcd(stride, size - 1) != 1:
+        stride += 1
+    return np.arange(count, dtype=np.int64) * stride % (size - 1) + 1
+
+
+def hide_message_full(image, message, codec='auto', ecc_symbols=0, density=1):
+    """Full mode hide_message, see hide_message."""
+    if not message or not 1 <= density <= MAX_DENSITY:
+        return None
+    frame = payload.pack(message, codec, ecc_symbols, density)
+    if not fits(frame, image.shape, 'full', density):
+        return None  # Message doesn't fit in the image
+
+    # Convert the image to YCbCr color space
+    ycbcr = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+    y, cb, cr = cv2.split(ycbcr)
+
+    # Apply DCT to the Y channel
+    dct = cv2.dct(np.float32(y))
+
+    # Embed the framed message into the DCT coefficients, spread over the whole matrix
+    symbols, levels = frame_symbols(frame, density)
+    flat = dct.reshape(-1)
+    slots = full_slots(flat.size, len(symbols))
+    target = qim_write(flat[slots], symbols, levels)
+    written = target.copy()
+    for _ in range(MARK_PASSES):
+        flat[slots] = written
+
+        # Perform inverse DCT to get the Y channel back
+        y = np.round(cv2.idct(dct)).clip(0, 255).astype(np.uint8)
+
+        # Merge the channels and convert back to BGR color space
+        marked = cv2.cvtColor(cv2.merge([y, cb, cr]), cv2.COLOR_YCrCb2BGR)
+
+        # Check what survived, and correct for what didn't
+        survived = cv2.dct(np.float32(cv2.cvtColor(marked, cv2.COLOR_BGR2YCrCb)[:, :, 0])).reshape(-1)[slots]
+        wrong = qim_read(survived, levels) != symbols
+        if not wrong.any():
+            break
+        written[wrong] += (target - survived)[wrong]
+    return marked
+
+
+def extract_message_full(image):
+    """Full mode extract_message, see extract_message."""
+    # Convert the image to YCbCr color space
+    ycbcr = cv2.cvtColor(image, cv2.COLOR_BGR2YCrCb)
+    y, _, _ = cv2.split(ycbcr)
+
+    # Apply DCT to the Y channel
+    dct = cv2.dct(np.float32(y))
+
+    # Read the header first, an image without a message stops there, then exactly the body it describes
+    flat = dct.reshape(-1)
+    return read_frame(lambda count, levels: qim_read(flat[full_slots(flat.size, count)], levels), y.shape, 'full')
+
+
+def hide_message(image, message, mode='block', codec='auto', ecc_symbols=0, density=1):
+    """Return a copy of a BGR image with message hidden in it, or None if there's nothing to hide
+    or it doesn't fit.
+
+    The message is compressed with codec ('auto' picks the smallest of payload.CODECS) and
+    protected by ecc_symbols Reed-Solomon symbols, then density bits of it are put in each
+    coefficient.
+    """
+    if mode == 'block':
+        return hide_message_blocks(image, message, codec, ecc_symbols, density)
+    return hide_message_full(image, message, codec, ecc_symbols, density)
+
+
+def extract_message(image, mode=None):
+    """Return the message hidden in a BGR image, or None if it doesn't hold one.
+
+    Without a mode, block mode is tried first and then full mode. Raises payload.PayloadError
+    if a message is there but damaged beyond repair.
+    """
+    if mode in ('block', None):
+        message = extract_message_blocks(image)
+        if message is not None or mode == 'block':
+            return message
+    return extract_message_full(image)
+
+
+def add_payload_arguments(parser):
+    """Add the --codec, --ecc and --density options of hide_message to an argparse parser."""
+    parser.add_argument('--codec', choices=['auto'] + payload.CODECS, default='auto',
+                        help='Compression for the message (default: whichever is smallest)')
+    parser.add_argument('--ecc', type=int, default=0, metavar='SYMBOLS',
+                        help='Reed-Solomon symbols per 255 byte block, needs reedsolo (default 0, none)')
+    parser.add_argument('--density', type=int, default=1, choices=range(1, MAX_DENSITY + 1),
+                        help='Bits hidden in each coefficient, more holds more but survives less (default 1)')
+
+
+def read_image(path):
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f'Could not read image {path}')
+    return image
+
+
+def write_image(path, image):
+    if not cv2.imwrite(path, image):
+        raise ValueError(f'Could not write image {path}')
@@ -0,0 +1,235 @@
+import argparse
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import payload
+import steg
+
+# Tiled block mode for images too big to hold in memory, such as gigapixel scans. The image
+# is read in horizontal strips of whole 8x8 block rows, straight from a memory map when it is
+# a .npy file, a raw BGR dump or (with tifffile installed) an uncompressed TIFF, so only one
+# strip's working copies are in memory at a time. Strips are as tall as --memory-mb allows:
+#   python tiled.py embed scan.npy marked.npy --message "(c) ACME" --memory-mb 256
+#   python tiled.py extract marked.npy
+#   python tiled.py extract dump.raw --shape 40000x60000
+# Messages are the same framed payloads as steg.py's block mode, an image marked here reads
+# back with it too.
+
+# Bytes of working memory per pixel of a strip: the strip itself, its YCrCb copy, the float32
+# luma, DCT blocks and pixels coming back with the temporaries NumPy makes on the way, and the
+# converted result
+WORKING_BYTES_PER_PIXEL = 3 + 3 + 4 * 5 + 3
+
+DEFAULT_MEMORY_MB = 256
+
+
+def strip_rows(width, memory_budget):
+    """Tallest strip, in whole block rows, whose working copies fit in memory_budget bytes."""
+    rows = memory_budget // (width * WORKING_BYTES_PER_PIXEL) // steg.BLOCK_SIZE * steg.BLOCK_SIZE
+    if rows < steg.BLOCK_SIZE:
+        raise ValueError(f'A memory budget of {memory_budget} bytes is too small for an image '
+                         f'{width} pixels wide')
+    return rows
+
+
+def open_image(path, shape=None, writable=False):
+    """Open an image for strip-wise access, returns (array, channel order).
+
+    .npy, .raw and (with tifffile) uncompressed TIFFs are memory-mapped, anything else is read
+    whole with OpenCV. Raw files are 8-bit BGR and need shape as (height, width).
+    """
+    mode = 'r+' if writable else 'r'
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.load(path, mmap_mode=mode), 'bgr'
+    if extension == '.raw':
+        if shape is None:
+            raise ValueError('Raw images need their shape, e.g. --shape 40000x60000')
+        return np.memmap(path, dtype=np.uint8, mode=mode, shape=(*shape, 3)), 'bgr'
+    if extension in ('.tif', '.tiff'):
+        try:
+            import tifffile
+
+            return tifffile.memmap(path, mode=mode), 'rgb'
+        except (ImportError, ValueError):
+            pass  # no tifffile, or compressed so it can't be mapped
+    return steg.read_image(path), 'bgr'
+
+
+def create_image(path, shape, order):
+    """Create the output image, returns (array, channel order) like open_image.
+
+    The formats open_image maps are memory-mapped. A TIFF is only mapped when the input was
+    a mapped TIFF too (order 'rgb'), anything else is BGR for OpenCV to write.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=shape), 'bgr'
+    if extension == '.raw':
+        return np.memmap(path, dtype=np.uint8, mode='w+', shape=shape), 'bgr'
+    if extension in ('.tif', '.tiff') and order == 'rgb':
+        import tifffile
+
+        return tifffile.memmap(path, shape=shape, dtype=np.uint8, photometric='rgb'), 'rgb'
+    return np.empty(shape, dtype=np.uint8), 'bgr'
+
+
+def color_codes(order):
+    if order == 'rgb':
+        return cv2.COLOR_RGB2YCrCb, cv2.COLOR_YCrCb2RGB
+    return cv2.COLOR_BGR2YCrCb, cv2.COLOR_YCrCb2BGR
+
+
+def strip_slots(strip):
+    return (strip.shape[0] // steg.BLOCK_SIZE) * (strip.shape[1] // steg.BLOCK_SIZE) * len(steg.BLOCK_POSITIONS)
+
+
+def hide_message_tiled(source, destination, message, memory_budget, order='bgr', progress=None,
+                       codec='auto', ecc_symbols=0, density=1, destination_order=None):
+    """Hide message in source a strip at a time, writing the result to destination.
+
+    destination can be source itself (opened writable), then only the strips holding the
+    message are touched. Strips are flipped between RGB and BGR when destination_order
+    (default: order) differs from the source's. progress is called with the fraction done
+    after every strip. codec, ecc_symbols and density are as for steg.hide_message.
+    Returns False if the message is empty or doesn't fit.
+    """
+    if not message or not 1 <= density <= steg.MAX_DENSITY:
+        return False
+    frame = payload.pack(message, codec, ecc_symbols, density)
+    if not steg.fits(frame, source.shape, 'block', density):
+        return False
+    to_ycrcb, from_ycrcb = color_codes(order)
+    flip = destination_order not in (None, order)
+    symbols, levels = steg.frame_symbols(frame, density)
+    rows = strip_rows(source.shape[1], memory_budget)
+    done = 0
+    for top in range(0, source.shape[0], rows):
+        if done >= len(symbols) and destination is source:
+            break
+        strip = np.asarray(source[top:top + rows])
+        capacity = strip_slots(strip)
+        if done < len(symbols) and capacity:
+            strip = steg.mark_blocks(strip, symbols[done:done + capacity], levels[done:done + capacity],
+                                     to_ycrcb, from_ycrcb)
+            done += capacity
+        destination[top:top + rows] = strip[..., ::-1] if flip else strip
+        if progress:
+            progress(min(1.0, (top + rows) / source.shape[0]))
+    if hasattr(destination, 'flush'):
+        destination.flush()
+    return True
+
+
+def read_symbols_tiled(source, count, levels, rows, order, progress=None):
+    """Read the first count QIM symbols of source, a strip at a time."""
+    to_ycrcb, _ = color_codes(order)
+    levels = np.broadcast_to(levels, count)
+    chunks = []
+    have = 0
+    for top in range(0, source.shape[0], rows):
+        strip = np.asarray(source[top:top + rows])
+        wanted = min(count - have, strip_slots(strip))
+        if wanted <= 0:
+            break
+        y = cv2.cvtColor(strip, to_ycrcb)[:, :, 0]
+        chunks.append(steg.read_block_symbols(y, wanted, levels[have:have + wanted]))
+        have += wanted
+        if progress:
+            progress(have / count)
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+
+
+def extract_message_tiled(source, memory_budget, order='bgr', progress=None):
+    """Return the block mode message hidden in source, reading it a strip at a time.
+
+    progress is called with the fraction read after every strip of the message. Only the
+    header's strips are read from an image without a message.
+    """
+    if steg.block_capacity(source.shape) == 0:
+        return None
+    rows = strip_rows(source.shape[1], memory_budget)
+
+    def read_symbols(count, levels):
+        # The header is read quietly, progress follows the whole frame
+        return read_symbols_tiled(source, count, levels, rows, order, progress if count > steg.HEADER_SLOTS else None)
+
+    return steg.read_frame(read_symbols, source.shape)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def parse_shape(value):
+    height, _, width = value.lower().partition('x')
+    return int(height), int(width)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Hide or read block mode messages in very large images, '
+                                                 'a strip at a time')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    embed = subparsers.add_parser('embed', help='Hide a message')
+    embed.add_argument('input', help='Image, .npy/.raw/.tif are memory-mapped')
+    embed.add_argument('output', help='Image to write, the same as input to mark it in place')
+    message = embed.add_mutually_exclusive_group(required=True)
+    message.add_argument('--message', help='Message to hide')
+    message.add_argument('--message-file', help='UTF-8 text file holding the message to hide')
+    steg.add_payload_arguments(embed)
+
+    extract = subparsers.add_parser('extract', help='Read a hidden message')
+    extract.add_argument('input', help='Image, .npy/.raw/.tif are memory-mapped')
+
+    for sub in (embed, extract):
+        sub.add_argument('--shape', type=parse_shape, help='HEIGHTxWIDTH of a .raw image')
+        sub.add_argument('--memory-mb', type=float, default=DEFAULT_MEMORY_MB,
+                         help='Most working memory used for strips, excluding the memory map itself')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    memory_budget = int(args.memory_mb * 1024 * 1024)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    if args.command == 'embed':
+        if args.message_file:
+            with open(args.message_file, encoding='utf-8') as f:
+                args.message = f.read()
+        in_place = os.path.exists(args.output) and os.path.samefile(args.input, args.output)
+        source, order = open_image(args.input, args.shape, writable=in_place)
+        if in_place:
+            destination, destination_order = source, order
+        else:
+            destination, destination_order = create_image(args.output, source.shape, order)
+        if not hide_message_tiled(source, destination, args.message, memory_budget, order,
+                                  codec=args.codec, ecc_symbols=args.ecc, density=args.density,
+                                  destination_order=destination_order):
+            sys.exit(f'Message is empty or does not fit, the image holds '
+                     f'{steg.block_capacity(source.shape, args.density)} bytes after compression')
+        if not isinstance(destination, np.memmap):
+            steg.write_image(args.output, destination)
+        print(f'Hid {len(args.message.encode("utf-8"))} bytes in {args.output}')
+    else:
+        source, order = open_image(args.input, args.shape)
+        message = extract_message_tiled(source, memory_budget, order)
+        print(message if message is not None else 'No hidden message found.')
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+
+    mapped = isinstance(source, np.memmap)
+    print(f'{source.shape[1]}x{source.shape[0]} image ({"memory-mapped" if mapped else "read whole"}) '
+          f'in {elapsed:.2f}s, {strip_rows(source.shape[1], memory_budget)} rows per strip, '
+          f'peak allocations {traced_peak / 2 ** 20:.1f} MB (budget {args.memory_mb:g} MB), '
+          f'peak RSS {peak_rss_mb():.1f} MB including mapped pages the OS can drop', file=sys.stderr)
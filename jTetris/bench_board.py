@@ -0,0 +1,99 @@
+import argparse
+import random
+import time
+
+import engine
+
+# Microbenchmark of the bitboard in engine.py against the list-of-lists board it replaced,
+# on the same random mid-game boards and piece positions:
+#   python bench_board.py --checks 200000 --clears 20000
+
+
+def legacy_create_board():
+    return [[0] * engine.BOARD_COLUMNS for _ in range(engine.BOARD_ROWS)]
+
+
+def legacy_is_valid_move(board, tetromino, dx, dy):
+    for y, row in enumerate(tetromino.shape):
+        for x, cell in enumerate(row):
+            if cell:
+                new_x = tetromino.x + x + dx
+                new_y = tetromino.y + y + dy
+                if new_x < 0 or new_x >= len(board[0]) or new_y >= len(board) or board[new_y][new_x]:
+                    return False
+    return True
+
+
+def legacy_clear_lines(board):
+    lines_to_clear = [y for y, row in enumerate(board) if all(row)]
+    if lines_to_clear:
+        board = [row for y, row in enumerate(board) if y not in lines_to_clear]
+        new_board = [[0] * len(board[0]) for _ in range(len(lines_to_clear))]
+        board = new_board + board
+    return board, len(lines_to_clear)
+
+
+def random_boards(count, rng, full_lines=0):
+    """Yield (list board, bitboard) pairs with the same cells filled in their bottom half."""
+    for _ in range(count):
+        legacy = legacy_create_board()
+        board = engine.create_board()
+        for y in range(engine.BOARD_ROWS // 2, engine.BOARD_ROWS):
+            full = y >= engine.BOARD_ROWS - full_lines
+            for x in range(engine.BOARD_COLUMNS):
+                if full or rng.random() < 0.6:
+                    color = rng.choice(engine.COLORS)
+                    legacy[y][x] = color
+                    board.rows[y] |= 1 << x
+                    board.colors[y][x] = color
+        yield legacy, board
+
+
+def time_calls(fn, calls):
+    start = time.perf_counter()
+    for args in calls:
+        fn(*args)
+    return time.perf_counter() - start
+
+
+def report(name, count, legacy_seconds, bitboard_seconds):
+    print(f'{name:<14} {count / legacy_seconds:>12,.0f}/s {count / bitboard_seconds:>12,.0f}/s '
+          f'{legacy_seconds / bitboard_seconds:>7.1f}x')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the bitboard with the old list-of-lists board')
+    parser.add_argument('--checks', type=int, default=200000, help='Collision checks to time')
+    parser.add_argument('--clears', type=int, default=20000, help='Line clears to time')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    rng = random.Random(args.seed)
+
+    # Collision checks of random pieces, rotations and positions, about half of them collide
+    boards = list(random_boards(64, rng))
+    legacy_calls, bitboard_calls = [], []
+    for _ in range(args.checks):
+        legacy, board = rng.choice(boards)
+        piece = engine.Tetromino(rng.randrange(-1, engine.BOARD_COLUMNS), rng.randrange(2, engine.BOARD_ROWS - 2), rng)
+        for _ in range(rng.randrange(4)):
+            piece.rotate()  # moves the piece at most 2 rows up, the old board wrapped negative rows around
+        dx, dy = rng.choice(list(engine.MOVES.values()))
+        legacy_calls.append((legacy, piece, dx, dy))
+        bitboard_calls.append((board, piece, dx, dy))
+    assert [legacy_is_valid_move(*call) for call in legacy_calls] == \
+        [engine.is_valid_move(*call) for call in bitboard_calls]
+
+    # Line clears on fresh copies of boards with 0 to 4 full lines
+    pairs = [pair for lines in range(5) for pair in random_boards(args.clears // 5, rng, lines)]
+    legacy_clears = [(legacy,) for legacy, _ in pairs]
+    bitboard_clears = [(board,) for _, board in pairs]
+
+    print(f'{"":<14} {"lists":>14} {"bitboard":>14} {"speedup":>8}')
+    report('is_valid_move', args.checks, time_calls(legacy_is_valid_move, legacy_calls),
+           time_calls(engine.is_valid_move, bitboard_calls))
+    report('clear_lines', len(pairs), time_calls(legacy_clear_lines, legacy_clears),
+           time_calls(engine.clear_lines, bitboard_clears))
@@ -0,0 +1,342 @@
+import random
+
+# The rules of Tetris without any drawing, shared by the pygame front ends (main.py and
+# rewrittenConcise.py) and the headless runner. Nothing here imports pygame, so bots and
+# regression games can play without a display.
+#
+# The board is a bitboard: one int per row with bit x set when column x is filled, and the
+# colors in a side grid only the front ends read. Pieces carry a row mask per shape row, so
+# a collision test is a few ANDs and a full line is a row equal to Board.full.
+
+BOARD_COLUMNS = 10
+BOARD_ROWS = 20
+
+# Define colors
+COLORS = [
+    (0, 255, 255),  # Cyan
+    (0, 0, 255),    # Blue
+    (255, 165, 0),  # Orange
+    (255, 255, 0),  # Yellow
+    (0, 255, 0),    # Green
+    (128, 0, 128),  # Purple
+    (255, 0, 0)     # Red
+]
+
+# Actions a player or bot can apply to a game
+LEFT = 'left'
+RIGHT = 'right'
+DOWN = 'down'
+ROTATE = 'rotate'
+DROP = 'drop'
+ACTIONS = [LEFT, RIGHT, DOWN, ROTATE, DROP]
+
+MOVES = {LEFT: (-1, 0), RIGHT: (1, 0), DOWN: (0, 1)}
+
+# Milliseconds a piece takes to fall one row at level 1, later levels follow the guideline
+# gravity curve from there
+GRAVITY_MS = 500
+
+# Milliseconds full lines stay on the board before they are cleared, for the front end to show
+LINE_CLEAR_MS = 170
+
+
+# Each shape's SRS (Super Rotation System) bounding box in rotation state 0. Shapes rotate
+# about the box's center, and a state's shape is the tight box around its cells, so the
+# states in Tetromino.SHAPES (the ones pieces spawn in) are found among the four rotations
+SRS_BOXES = [
+    ['....', '####', '....', '....'],  # I shape
+    ['.#.', '###', '...'],  # T shape
+    ['..#', '###', '...'],  # L shape
+    ['#..', '###', '...'],  # J shape
+    ['##', '##'],  # O shape
+    ['##.', '.##', '...'],  # S shape
+    ['.##', '##.', '...']   # Z shape
+]
+
+# SRS wall kicks, the offsets tried in order when rotating from one state to the next
+# clockwise (0 -> 1 -> 2 -> 3 -> 0), as (x, y) with y up like the guideline tables
+JLSTZ_KICKS = [
+    [(0, 0), (-1, 0), (-1, 1), (0, -2), (-1, -2)],  # 0 -> R
+    [(0, 0), (1, 0), (1, -1), (0, 2), (1, 2)],      # R -> 2
+    [(0, 0), (1, 0), (1, 1), (0, -2), (1, -2)],     # 2 -> L
+    [(0, 0), (-1, 0), (-1, -1), (0, 2), (-1, 2)]    # L -> 0
+]
+I_KICKS = [
+    [(0, 0), (-2, 0), (1, 0), (-2, -1), (1, 2)],    # 0 -> R
+    [(0, 0), (-1, 0), (2, 0), (-1, 2), (2, -1)],    # R -> 2
+    [(0, 0), (2, 0), (-1, 0), (2, 1), (-1, -2)],    # 2 -> L
+    [(0, 0), (1, 0), (-2, 0), (1, -2), (-2, 1)]     # L -> 0
+]
+
+
+class Tetromino:
+    """
+    Class defining the layouts and behavior of the tetromino pieces
+    """
+    SHAPES = [
+        [[1, 1, 1, 1]],  # I shape
+        [[1, 1, 1], [0, 1, 0]],  # T shape
+        [[1, 1, 1], [1, 0, 0]],  # L shape
+        [[1, 1, 1], [0, 0, 1]],  # J shape
+        [[1, 1], [1, 1]],  # O shape
+        [[1, 1, 0], [0, 1, 1]],  # S shape
+        [[0, 1, 1], [1, 1, 0]]   # Z shape
+    ]
+
+    def __init__(self, x, y, rng=random):
+        self.x = x
+        self.y = y
+        self.kind = rng.randrange(len(self.SHAPES))
+        self.set_rotation(SPAWN_ROTATIONS[self.kind])
+        self.color = rng.choice(COLORS)
+
+    def set_rotation(self, rotation):
+        self.rotation = rotation
+        self.shape, self.masks, self.width, self.offset = ROTATIONS[self.kind][rotation]
+
+    def rotate(self, direction=1):
+        """Rotate clockwise (1) or anticlockwise (-1) about the SRS center, without kicks."""
+        old_offset = self.offset
+        self.set_rotation((self.rotation + direction) % 4)
+        self.move(self.offset[0] - old_offset[0], self.offset[1] - old_offset[1])
+
+    def move(self, dx, dy):
+        self.x += dx
+        self.y += dy
+
+    def copy(self):
+        tetromino = Tetromino.__new__(Tetromino)
+        tetromino.__dict__.update(self.__dict__)
+        return tetromino
+
+
+def row_masks(shape):
+    """Return a shape's rows as bitmasks, bit x set for column x."""
+    return tuple(sum(1 << x for x, cell in enumerate(row) if cell) for row in shape)
+
+
+def rotation_states(box):
+    """Return the four (shape, row masks, width, offset in the box) states of an SRS box."""
+    grid = [[int(cell == '#') for cell in row] for row in box]
+    states = []
+    for _ in range(4):
+        rows = [y for y, row in enumerate(grid) if any(row)]
+        columns = [x for x in range(len(grid[0])) if any(row[x] for row in grid)]
+        shape = tuple(tuple(grid[y][x] for x in columns) for y in rows)
+        states.append((shape, row_masks(shape), len(columns), (columns[0], rows[0])))
+        grid = [list(row) for row in zip(*grid[::-1])]
+    return tuple(states)
+
+
+def rotation_kicks(kind):
+    """Return kicks[rotation][direction] for a shape, the (dx, dy) moves to try after a basic
+    rotation, with y down like the board."""
+    if len(SRS_BOXES[kind]) == 2:
+        table = [[(0, 0)]] * 4  # the O shape doesn't need kicks
+    else:
+        table = I_KICKS if len(SRS_BOXES[kind]) == 4 else JLSTZ_KICKS
+    kicks = []
+    for rotation in range(4):
+        clockwise = tuple((x, -y) for x, y in table[rotation])
+        # Anticlockwise kicks are the clockwise ones into this state, reversed
+        anticlockwise = tuple((-x, y) for x, y in table[(rotation - 1) % 4])
+        kicks.append({1: clockwise, -1: anticlockwise})
+    return tuple(kicks)
+
+
+# Rotation states of every shape and the kicks from each, computed once
+ROTATIONS = tuple(rotation_states(box) for box in SRS_BOXES)
+KICKS = tuple(rotation_kicks(kind) for kind in range(len(SRS_BOXES)))
+SPAWN_ROTATIONS = tuple(next(rotation for rotation, state in enumerate(states) if state[0] == tuple(map(tuple, shape)))
+                        for states, shape in zip(ROTATIONS, Tetromino.SHAPES))
+
+
+class Board:
+    """
+    Bitboard of the locked cells, with their colors alongside for drawing
+    """
+
+    def __init__(self, columns=BOARD_COLUMNS, height=BOARD_ROWS):
+        self.columns = columns
+        self.height = height
+        self.full = (1 << columns) - 1
+        self.rows = [0] * height
+        self.colors = [[0] * columns for _ in range(height)]
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.columns, board.height, board.full = self.columns, self.height, self.full
+        board.rows = self.rows[:]
+        board.colors = [row[:] for row in self.colors]
+        return board
+
+
+def spawn_tetromino(rng=random):
+    return Tetromino(BOARD_COLUMNS // 2, 0, rng)
+
+
+def create_board():
+    return Board()
+
+
+def is_valid_move(board, tetromino, dx, dy):
+    """Whether the tetromino fits moved by (dx, dy). Rows above the board count as empty, so
+    pieces can rotate and kick up past the top the way they do with SRS's hidden rows."""
+    x = tetromino.x + dx
+    y = tetromino.y + dy
+    masks = tetromino.masks
+    if x < 0 or x + tetromino.width > board.columns or y + len(masks) > board.height:
+        return False
+    if y < 0:
+        masks = masks[-y:]
+        y = 0
+    rows = board.rows
+    for i, mask in enumerate(masks):
+        if rows[y + i] & (mask << x):
+            return False
+    return True
+
+
+def rotate_tetromino(board, tetromino, direction=1):
+    """Rotate with SRS wall kicks, trying each kick in turn. Returns False, leaving the
+    tetromino as it was, if none of them fit."""
+    x, y, rotation = tetromino.x, tetromino.y, tetromino.rotation
+    tetromino.rotate(direction)
+    for dx, dy in KICKS[tetromino.kind][rotation][direction]:
+        if is_valid_move(board, tetromino, dx, dy):
+            tetromino.move(dx, dy)
+            return True
+    tetromino.set_rotation(rotation)
+    tetromino.x, tetromino.y = x, y
+    return False
+
+
+def lock_tetromino(board, tetromino):
+    for i, mask in enumerate(tetromino.masks):
+        board.rows[tetromino.y + i] |= mask << tetromino.x
+    for y, row in enumerate(tetromino.shape):
+        for x, cell in enumerate(row):
+            if cell:
+                board.colors[tetromino.y + y][tetromino.x + x] = tetromino.color
+
+
+def full_lines(board):
+    return [y for y, row in enumerate(board.rows) if row == board.full]
+
+
+def clear_lines(board):
+    """Remove the full lines in place, returns the board and how many were cleared."""
+    if board.full not in board.rows:
+        return board, 0
+    lines_to_clear = full_lines(board)
+    for y in reversed(lines_to_clear):
+        del board.rows[y]
+        del board.colors[y]
+    board.rows[:0] = [0] * len(lines_to_clear)
+    board.colors[:0] = [[0] * board.columns for _ in lines_to_clear]
+    return board, len(lines_to_clear)
+
+
+def update_level_and_score(lines, score, level):
+    score += lines * 100
+    level = score // 1000 + 1
+    return score, level
+
+
+def gravity_interval(level):
+    """Milliseconds per row of gravity at a level, faster every level."""
+    return GRAVITY_MS * max(0.8 - (level - 1) * 0.007, 0.05) ** (level - 1)
+
+
+class Game:
+    """
+    One game of Tetris, driven by apply(action) for the player and step() for gravity
+
+    With auto_clear off, a lock that fills lines leaves them on the board in `clearing` until
+    clear() is called, so a front end can show them first. Actions are ignored meanwhile.
+    Real-time front ends call tick(ms) instead of step(), which applies gravity for the level
+    and clears lines once they have been shown for LINE_CLEAR_MS.
+    """
+
+    def __init__(self, seed=None, auto_clear=True):
+        self.rng = random.Random(seed)
+        self.auto_clear = auto_clear
+        self.reset()
+
+    def reset(self):
+        self.board = create_board()
+        self.current = spawn_tetromino(self.rng)
+        self.next = spawn_tetromino(self.rng)
+        self.score = 0
+        self.level = 1
+        self.lines = 0
+        self.pieces = 0
+        self.clearing = []
+        self.game_over = False
+        self.fall_time = 0
+        self.clear_time = 0
+
+    def apply(self, action):
+        """Apply one of ACTIONS, returns whether it changed anything."""
+        if self.game_over or self.clearing:
+            return False
+        if action in MOVES:
+            dx, dy = MOVES[action]
+            if not is_valid_move(self.board, self.current, dx, dy):
+                return False
+            self.current.move(dx, dy)
+        elif action == ROTATE:
+            return rotate_tetromino(self.board, self.current)
+        elif action == DROP:
+            while is_valid_move(self.board, self.current, 0, 1):
+                self.current.move(0, 1)
+            self.lock()
+        else:
+            raise ValueError(f'Unknown action {action!r}')
+        return True
+
+    def tick(self, ms):
+        """Advance the game clock by ms milliseconds."""
+        if self.game_over:
+            return
+        if self.clearing:
+            self.clear_time += ms
+            if self.clear_time >= LINE_CLEAR_MS:
+                self.clear()
+            return
+        self.fall_time += ms
+        interval = gravity_interval(self.level)
+        while self.fall_time >= interval and not (self.clearing or self.game_over):
+            self.fall_time -= interval
+            self.step()
+
+    def step(self):
+        """One gravity step, the piece falls a row or locks."""
+        if self.game_over or self.clearing:
+            return
+        if is_valid_move(self.board, self.current, 0, 1):
+            self.current.move(0, 1)
+        else:
+            self.lock()
+
+    def lock(self):
+        if self.current.y < 0:
+            # Part of the piece would lock above the board, the stack has topped out
+            self.game_over = True
+            return
+        lock_tetromino(self.board, self.current)
+        self.pieces += 1
+        self.clearing = full_lines(self.board)
+        if self.auto_clear or not self.clearing:
+            self.clear()
+
+    def clear(self):
+        """Remove the lines being cleared, score them and bring in the next piece."""
+        self.board, lines = clear_lines(self.board)
+        self.score, self.level = update_level_and_score(lines, self.score, self.level)
+        self.lines += lines
+        self.clearing = []
+        self.clear_time = 0
+        self.current, self.next = self.next, spawn_tetromino(self.rng)
+        if not is_valid_move(self.board, self.current, 0, 0):
+            self.game_over = True
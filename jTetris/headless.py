@@ -0,0 +1,124 @@
+import argparse
+import json
+import random
+import sys
+import time
+
+import engine
+
+# Plays Tetris without a display, for training bots and running regression games in CI:
+#   python headless.py --pieces 1000000 --policy random --seed 1
+#   python headless.py --pieces 2000 --policy greedy --seed 7 --json
+# A policy is called with the game and a random.Random and returns the actions for the
+# current piece, the runner drops the piece if they don't. The same seed plays the same games.
+
+
+def random_policy(game, rng):
+    """Rotate and shift the piece a random amount, then drop it."""
+    shift = rng.randint(-engine.BOARD_COLUMNS // 2, engine.BOARD_COLUMNS // 2)
+    move = engine.LEFT if shift < 0 else engine.RIGHT
+    return [engine.ROTATE] * rng.randrange(4) + [move] * abs(shift) + [engine.DROP]
+
+
+def placements(game):
+    """Yield (actions, board rows after the drop, lines cleared) for every placement of the current piece."""
+    board = game.board
+    piece = game.current.copy()
+    for rotations in range(4):
+        if rotations and not engine.rotate_tetromino(board, piece):
+            break
+        start_x = piece.x
+        # Slide as far left as the piece goes, then try every column on the way right
+        while engine.is_valid_move(board, piece, -1, 0):
+            piece.move(-1, 0)
+        while True:
+            y = piece.y
+            while engine.is_valid_move(board, piece, 0, 1):
+                piece.move(0, 1)
+            if piece.y >= 0:  # locking above the board ends the game, that's no placement
+                rows = board.rows[:]
+                for i, mask in enumerate(piece.masks):
+                    rows[piece.y + i] |= mask << piece.x
+                kept = [row for row in rows if row != board.full]
+                lines = len(rows) - len(kept)
+                shift = piece.x - start_x
+                move = engine.LEFT if shift < 0 else engine.RIGHT
+                yield [engine.ROTATE] * rotations + [move] * abs(shift) + [engine.DROP], [0] * lines + kept, lines
+            piece.y = y
+            if not engine.is_valid_move(board, piece, 1, 0):
+                break
+            piece.move(1, 0)
+        piece.x = start_x
+
+
+def evaluate(rows, lines):
+    """Score board rows for the greedy policy, higher is better."""
+    heights = [0] * engine.BOARD_COLUMNS
+    holes = 0
+    covered = 0  # columns with a filled cell above the current row
+    for y, row in enumerate(rows):
+        holes += bin(covered & ~row).count('1')
+        new = row & ~covered
+        while new:
+            heights[(new & -new).bit_length() - 1] = len(rows) - y
+            new &= new - 1
+        covered |= row
+    bumpiness = sum(abs(a - b) for a, b in zip(heights, heights[1:]))
+    return 0.76 * lines - 0.51 * sum(heights) - 0.36 * holes - 0.18 * bumpiness
+
+
+def greedy_policy(game, rng):
+    """Take the placement with the best evaluate() score, one piece ahead."""
+    best = max(placements(game), key=lambda placement: evaluate(placement[1], placement[2]), default=None)
+    return best[0] if best else [engine.DROP]
+
+
+POLICIES = {'random': random_policy, 'greedy': greedy_policy}
+
+
+def play(policy, pieces, seed=None):
+    """Play games back to back until `pieces` pieces have locked, returns their statistics."""
+    rng = random.Random(seed)
+    game = engine.Game(rng.random())
+    games = lines = score = 0
+    best_score = 0
+    start = time.perf_counter()
+    for _ in range(pieces):
+        locked = game.pieces
+        for action in policy(game, rng):
+            game.apply(action)
+        if game.pieces == locked:
+            game.apply(engine.DROP)
+        if game.game_over:
+            games += 1
+            lines += game.lines
+            score += game.score
+            best_score = max(best_score, game.score)
+            game.reset()
+    elapsed = time.perf_counter() - start
+    # The game still going counts too
+    lines += game.lines
+    score += game.score
+    best_score = max(best_score, game.score)
+    return {'pieces': pieces, 'games': games, 'lines': lines, 'score': score, 'best_score': best_score,
+            'seconds': elapsed, 'pieces_per_minute': pieces * 60 / elapsed if elapsed else 0}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simulate Tetris games without a display')
+    parser.add_argument('--pieces', type=int, default=100000, help='Pieces to play, across as many games as it takes')
+    parser.add_argument('--policy', choices=POLICIES, default='random', help='How pieces are placed')
+    parser.add_argument('--seed', type=int, help='Seed for repeatable games')
+    parser.add_argument('--json', action='store_true', help='Print the statistics as one JSON line')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    stats = play(POLICIES[args.policy], args.pieces, args.seed)
+    if args.json:
+        print(json.dumps(stats))
+    else:
+        print(f'{stats["pieces"]} pieces in {stats["games"]} finished games, {stats["lines"]} lines, '
+              f'best score {stats["best_score"]}')
+    print(f'{stats["seconds"]:.2f}s, {stats["pieces_per_minute"]:,.0f} pieces/minute', file=sys.stderr)
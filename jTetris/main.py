@@ -1,5 +1,8 @@
+import functools
+
 import pygame
-import random
+
+import engine
 
 # Initialize pygame
 pygame.init()
@@ -20,24 +23,20 @@ BLACK = (0, 0, 0)
 DARK_GREY = (50, 50, 50)
 WHITE = (255, 255, 255)
 DARK_RED = (255, 50, 75)
-COLORS = [
-    (0, 255, 255),  # Cyan
-    (0, 0, 255),    # Blue
-    (255, 165, 0),  # Orange
-    (255, 255, 0),  # Yellow
-    (0, 255, 0),    # Green
-    (128, 0, 128),  # Purple
-    (255, 0, 0)     # Red
-]
+
+# Keys and the game actions they trigger
+KEY_ACTIONS = {
+    pygame.K_LEFT: engine.LEFT,
+    pygame.K_RIGHT: engine.RIGHT,
+    pygame.K_DOWN: engine.DOWN,
+    pygame.K_UP: engine.ROTATE,
+    pygame.K_SPACE: engine.DROP
+}
 
 # Load background image
 background_image = pygame.image.load('background.jpg')
 background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
 
-# Screen setup
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption('Tetris')
-
 # Define fonts
 font = pygame.font.SysFont('Arial', 24)
 modern_font = pygame.font.SysFont('Calibri', 24, bold=True)
@@ -45,95 +44,28 @@ modern_font = pygame.font.SysFont('Calibri', 24, bold=True)
 # Clock for controlling the frame rate
 clock = pygame.time.Clock()
 
+# Frames drawn per second at most. The game itself advances in fixed ticks of TICK_MS,
+# however long frames take, and frames longer than MAX_FRAME_MS (a dragged window, a
+# debugger) are cut short rather than caught up on
+FPS = 60
+TICK_MS = 1000 / 120
+MAX_FRAME_MS = 250
 
-class Tetromino:
-    """
-    Class defining the layouts and behavior of the tetromino pieces
-    """
-    SHAPES = [
-        [[1, 1, 1, 1]],  # I shape
-        [[1, 1, 1], [0, 1, 0]],  # T shape
-        [[1, 1, 1], [1, 0, 0]],  # L shape
-        [[1, 1, 1], [0, 0, 1]],  # J shape
-        [[1, 1], [1, 1]],  # O shape
-        [[1, 1, 0], [0, 1, 1]],  # S shape
-        [[0, 1, 1], [1, 1, 0]]   # Z shape
-    ]
-
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.shape = random.choice(self.SHAPES)
-        self.color = random.choice(COLORS)
-
-    def rotate(self):
-        self.shape = [list(row) for row in zip(*self.shape[::-1])]
-
-    def move(self, dx, dy):
-        self.x += dx
-        self.y += dy
+# Colors lines are shown in while they clear, until the given milliseconds into the clear
+LINE_FLASHES = [(75, LINE_CLEAR_COLOR), (engine.LINE_CLEAR_MS, WHITE)]
 
 
-def create_board():
-    return [[0] * (BOARD_WIDTH // CELL_SIZE) for _ in range(BOARD_HEIGHT // CELL_SIZE)]
-
-
-def is_valid_move(board, tetromino, dx, dy):
-    for y, row in enumerate(tetromino.shape):
-        for x, cell in enumerate(row):
-            if cell:
-                new_x = tetromino.x + x + dx
-                new_y = tetromino.y + y + dy
-                if new_x < 0 or new_x >= len(board[0]) or new_y >= len(board) or board[new_y][new_x]:
-                    return False
-    return True
-
-
-def lock_tetromino(board, tetromino):
-    for y, row in enumerate(tetromino.shape):
-        for x, cell in enumerate(row):
-            if cell:
-                board[tetromino.y + y][tetromino.x + x] = tetromino.color
-
+def flash_color(game):
+    """Return the color of the lines being cleared, or None when none are."""
+    if game.clearing:
+        return next(color for until, color in LINE_FLASHES if game.clear_time < until)
+    return None
 
-def clear_lines(board):
-    lines_to_clear = [y for y, row in enumerate(board) if all(row)]
-    if lines_to_clear:
-        for y in lines_to_clear:
-            board[y] = [LINE_CLEAR_COLOR] * len(board[0])
-        draw_board(screen, board)
-        pygame.display.flip()
-        pygame.time.delay(75)  # Short delay to show the line clear effect
 
-        for y in lines_to_clear:
-            board[y] = [(255, 255, 255)] * len(board[0])
-        draw_board(screen, board)
-        pygame.display.flip()
-        pygame.time.delay(95)  # Short delay to show the line clear effect
-
-        board = [row for y, row in enumerate(board) if y not in lines_to_clear]
-        new_board = [[0] * len(board[0]) for _ in range(len(lines_to_clear))]
-        board = new_board + board
-    return board, len(lines_to_clear)
-
-
-def update_level_and_score(lines, score, level):
-    score += lines * 100
-    level = score // 1000 + 1
-    return score, level
-
-
-def draw_board(screen, board):
-    for y, row in enumerate(board):
-        for x, cell in enumerate(row):
-            rect = pygame.Rect(x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-            pygame.draw.rect(screen, DARK_GREY, rect, 1)
-            if cell:
-                draw_gradient_rect(screen, rect, cell)
-
-
-def draw_gradient_rect(screen, rect, color):
-    """Draw a rectangle with a gradient effect."""
+@functools.lru_cache(maxsize=None)
+def cell_sprite(color, border=None):
+    """Return a cell drawn with a gradient effect, rendered once per color and border."""
+    sprite = pygame.Surface((CELL_SIZE, CELL_SIZE)).convert()
     color_dark = tuple(max(0, c - 50) for c in color)
     color_light = tuple(min(255, c + 50) for c in color)
 
@@ -144,123 +76,189 @@ def draw_gradient_rect(screen, rect, color):
             int(color_light[1] * (1 - ratio) + color_dark[1] * ratio),
             int(color_light[2] * (1 - ratio) + color_dark[2] * ratio)
         )
-        pygame.draw.line(screen, intermediate_color, (rect.left, rect.top + i), (rect.right, rect.top + i))
+        pygame.draw.line(sprite, intermediate_color, (0, i), (CELL_SIZE, i))
+    if border:
+        pygame.draw.rect(sprite, border, sprite.get_rect(), BORDER_WIDTH)
+    return sprite
 
 
-def draw_tetromino(screen, tetromino):
-    for y, row in enumerate(tetromino.shape):
+def draw_shape(screen, shape, left, top, color):
+    """Draw a tetromino shape with its top left cell at (left, top), returns the rect it covers."""
+    sprite = cell_sprite(color, DARK_RED)
+    for y, row in enumerate(shape):
         for x, cell in enumerate(row):
             if cell:
-                rect = pygame.Rect((tetromino.x + x) * CELL_SIZE, (tetromino.y + y) * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                draw_gradient_rect(screen, rect, tetromino.color)
-                pygame.draw.rect(screen, DARK_RED, rect, BORDER_WIDTH)
+                screen.blit(sprite, (left + x * CELL_SIZE, top + y * CELL_SIZE))
+    return pygame.Rect(left, top, len(shape[0]) * CELL_SIZE, len(shape) * CELL_SIZE).clip(screen.get_rect())
 
 
-def draw_status(screen, score, level, lines, next_tetromino):
-    score_text = modern_font.render(f'Score: {score}', True, WHITE)
-    level_text = modern_font.render(f'Level: {level}', True, WHITE)
-    lines_text = modern_font.render(f'Lines: {lines}', True, WHITE)
-    next_text = modern_font.render('Next:', True, WHITE)
-
-    screen.blit(score_text, (BOARD_WIDTH + 20, 20))
-    screen.blit(level_text, (BOARD_WIDTH + 20, 50))
-    screen.blit(lines_text, (BOARD_WIDTH + 20, 80))
-    screen.blit(next_text, (BOARD_WIDTH + 20, 110))
-
-    for y, row in enumerate(next_tetromino.shape):
-        for x, cell in enumerate(row):
-            if cell:
-                rect = pygame.Rect(BOARD_WIDTH + 20 + x * CELL_SIZE, 140 + y * CELL_SIZE, CELL_SIZE, CELL_SIZE)
-                draw_gradient_rect(screen, rect, next_tetromino.color)
-                pygame.draw.rect(screen, DARK_RED, rect, BORDER_WIDTH)
-
-
-def draw_game_over_screen(screen, font):
-    game_over_text = font.render('GAME OVER', True, (255, 0, 0))
-    restart_text = font.render('Press spacebar to play again!', True, (255, 255, 255))
-    ctrl_text = font.render('Arrow keys to move. Space to drop!', True, (255, 255, 255))
+class Renderer:
+    """
+    Draws the game in layers and only sends the parts of the screen that changed to the display
 
-    screen.blit(game_over_text, (SCREEN_WIDTH // 2 - game_over_text.get_width() // 2, SCREEN_HEIGHT // 2 - 50))
-    screen.blit(restart_text, (SCREEN_WIDTH // 2 - restart_text.get_width() // 2, SCREEN_HEIGHT // 2 + 10))
-    screen.blit(ctrl_text, (SCREEN_WIDTH // 2 - ctrl_text.get_width() // 2, SCREEN_HEIGHT // 2 + 80))
-    pygame.display.flip()
+    The grid and locked cells are drawn to a board layer that is only redrawn when the board
+    changes, when a piece locks or lines clear. Each frame the falling piece's old position is
+    restored from that layer before it is drawn at its new one, and the status text is only
+    rendered again when its value changes.
+    """
+    STATUS_LEFT = BOARD_WIDTH + 20
+    PREVIEW_TOP = 140
+
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = background_image.convert()
+
+        # The empty board, background and grid, drawn once
+        self.grid_layer = pygame.Surface((BOARD_WIDTH, BOARD_HEIGHT)).convert()
+        self.grid_layer.blit(self.background, (0, 0))
+        for y in range(BOARD_HEIGHT // CELL_SIZE):
+            for x in range(BOARD_WIDTH // CELL_SIZE):
+                pygame.draw.rect(self.grid_layer, DARK_GREY, (x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE), 1)
+        self.board_layer = self.grid_layer.copy()
+
+        self.text_cache = {}
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget what is on screen, the next frame is drawn in full."""
+        self.board_key = None
+        self.piece_key = None
+        self.piece_rect = None
+        self.next_piece = None
+        self.preview_rect = None
+        self.status = {}
+        self.showing_game_over = None
+
+    def text(self, font, text, color=WHITE):
+        """Return rendered text, rendering it only the first time it is shown."""
+        key = (font, text, color)
+        if key not in self.text_cache:
+            if len(self.text_cache) > 64:
+                self.text_cache.clear()
+            self.text_cache[key] = font.render(text, True, color)
+        return self.text_cache[key]
+
+    def restore(self, rect):
+        """Put the background back under rect."""
+        self.screen.blit(self.background, rect, rect)
+
+    def draw_board_layer(self, board, clearing, flash_color):
+        self.board_layer.blit(self.grid_layer, (0, 0))
+        for y, row in enumerate(board.colors):
+            color_override = flash_color if y in clearing else None
+            for x, cell in enumerate(row):
+                if cell:
+                    self.board_layer.blit(cell_sprite(color_override or cell), (x * CELL_SIZE, y * CELL_SIZE))
+
+    def draw_game_over(self):
+        self.screen.blit(self.background, (0, 0))
+        lines = [('GAME OVER', (255, 0, 0), -50), ('Press spacebar to play again!', WHITE, 10),
+                 ('Arrow keys to move. Space to drop!', WHITE, 80)]
+        for text, color, offset in lines:
+            rendered = self.text(font, text, color)
+            self.screen.blit(rendered, (SCREEN_WIDTH // 2 - rendered.get_width() // 2, SCREEN_HEIGHT // 2 + offset))
+
+    def render(self, game, flash_color=None):
+        """Draw whatever changed since the last frame and update those parts of the display.
+
+        flash_color draws the lines being cleared in that color. Returns the dirty rects.
+        """
+        dirty = []
+        if game.game_over != self.showing_game_over:
+            # Switching between playing and the game over screen, start from the background
+            self.invalidate()
+            self.showing_game_over = game.game_over
+            if game.game_over:
+                self.draw_game_over()
+            else:
+                self.screen.blit(self.background, (0, 0))
+            dirty.append(self.screen.get_rect())
+        if game.game_over:
+            pygame.display.update(dirty)
+            return dirty
+
+        # Locked cells, only when a piece has locked or lines are clearing
+        board_key = (id(game.board.colors), tuple(game.board.rows), tuple(game.clearing), flash_color)
+        board_redrawn = board_key != self.board_key
+        if board_redrawn:
+            self.board_key = board_key
+            self.draw_board_layer(game.board, game.clearing, flash_color)
+            self.screen.blit(self.board_layer, (0, 0))
+            dirty.append(self.board_layer.get_rect())
+
+        # The falling piece, restoring the board where it was. While lines clear the current
+        # piece has already locked into the board layer, so it isn't drawn over the flash
+        piece = game.current
+        piece_key = None if game.clearing else (piece.x, piece.y, piece.kind, piece.rotation, piece.color)
+        if piece_key != self.piece_key or board_redrawn:
+            if self.piece_rect and not board_redrawn:
+                self.screen.blit(self.board_layer, self.piece_rect, self.piece_rect)
+                dirty.append(self.piece_rect)
+            self.piece_key = piece_key
+            self.piece_rect = None
+            if piece_key:
+                self.piece_rect = draw_shape(self.screen, piece.shape, piece.x * CELL_SIZE, piece.y * CELL_SIZE,
+                                             piece.color)
+                dirty.append(self.piece_rect)
+
+        # Status text, each line only when its value changes
+        for i, text in enumerate([f'Score: {game.score}', f'Level: {game.level}', f'Lines: {game.lines}', 'Next:']):
+            if self.status.get(i) != text:
+                rect = pygame.Rect(self.STATUS_LEFT, 20 + i * 30, SCREEN_WIDTH - self.STATUS_LEFT, 30)
+                self.restore(rect)
+                self.screen.blit(self.text(modern_font, text), rect)
+                self.status[i] = text
+                dirty.append(rect)
+
+        # Next piece preview
+        if game.next is not self.next_piece:
+            if self.preview_rect:
+                self.restore(self.preview_rect)
+                dirty.append(self.preview_rect)
+            self.next_piece = game.next
+            self.preview_rect = draw_shape(self.screen, game.next.shape, self.STATUS_LEFT, self.PREVIEW_TOP,
+                                           game.next.color)
+            dirty.append(self.preview_rect)
+
+        if dirty:
+            pygame.display.update(dirty)
+        return dirty
 
 
 def main():
-    def reset_game():
-        return create_board(), Tetromino(BOARD_WIDTH // (2 * CELL_SIZE), 0), Tetromino(BOARD_WIDTH // (2 * CELL_SIZE), 0), 0, 1, 0
+    # Screen setup
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption('Tetris')
+    renderer = Renderer(screen)
 
-    board, current_tetromino, next_tetromino, score, level, lines_cleared = reset_game()
+    game = engine.Game(auto_clear=False)
 
     running = True
-    game_over = False
-    fall_time = 0
-    fall_speed = 500
+    lag = 0  # milliseconds of real time the game hasn't caught up on yet
 
     while running:
-        screen.blit(background_image, (0, 0))
-        fall_time += clock.get_rawtime()
-        clock.tick()
-
-        if not game_over:
-            if fall_time > fall_speed:
-                fall_time = 0
-                if not is_valid_move(board, current_tetromino, 0, 1):
-                    lock_tetromino(board, current_tetromino)
-                    board, lines = clear_lines(board)
-                    score, level = update_level_and_score(lines, score, level)
-                    lines_cleared += lines
-                    current_tetromino = next_tetromino
-                    next_tetromino = Tetromino(BOARD_WIDTH // (2 * CELL_SIZE), 0)
-                    if not is_valid_move(board, current_tetromino, 0, 0):
-                        game_over = True
-                else:
-                    current_tetromino.move(0, 1)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_LEFT and is_valid_move(board, current_tetromino, -1, 0):
-                        current_tetromino.move(-1, 0)
-                    elif event.key == pygame.K_RIGHT and is_valid_move(board, current_tetromino, 1, 0):
-                        current_tetromino.move(1, 0)
-                    elif event.key == pygame.K_DOWN and is_valid_move(board, current_tetromino, 0, 1):
-                        current_tetromino.move(0, 1)
-                    elif event.key == pygame.K_UP:
-                        current_tetromino.rotate()
-                        if not is_valid_move(board, current_tetromino, 0, 0):
-                            current_tetromino.rotate()
-                            current_tetromino.rotate()
-                            current_tetromino.rotate()
-                    elif event.key == pygame.K_SPACE:
-                        while is_valid_move(board, current_tetromino, 0, 1):
-                            current_tetromino.move(0, 1)
-                        lock_tetromino(board, current_tetromino)
-                        board, lines = clear_lines(board)
-                        score, level = update_level_and_score(lines, score, level)
-                        lines_cleared += lines
-                        current_tetromino = next_tetromino
-                        next_tetromino = Tetromino(BOARD_WIDTH // (2 * CELL_SIZE), 0)
-                        if not is_valid_move(board, current_tetromino, 0, 0):
-                            game_over = True
-
-            draw_board(screen, board)
-            draw_tetromino(screen, current_tetromino)
-            draw_status(screen, score, level, lines_cleared, next_tetromino)
-        else:
-            draw_game_over_screen(screen, font)
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    running = False
-                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                    board, current_tetromino, next_tetromino, score, level, lines_cleared = reset_game()
-                    game_over = False
-
-        pygame.display.flip()
+        # Sleeps out the rest of the frame, and returns the whole frame's time
+        lag = min(lag + clock.tick(FPS), MAX_FRAME_MS)
+
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN:
+                if game.game_over:
+                    if event.key == pygame.K_SPACE:
+                        game.reset()
+                        lag = 0
+                elif event.key in KEY_ACTIONS:
+                    game.apply(KEY_ACTIONS[event.key])
+
+        while lag >= TICK_MS:
+            game.tick(TICK_MS)
+            lag -= TICK_MS
+
+        renderer.render(game, flash_color(game))
 
     pygame.quit()
 
 
-# Uncomment the following line to run the game
-main()
+if __name__ == '__main__':
+    main()
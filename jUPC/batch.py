@@ -0,0 +1,298 @@
+import argparse
+import csv
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import extract
+import jUPC
+import retailers
+
+# Requests per second and requests in flight allowed per retailer, unless overridden
+DEFAULT_RATE_LIMIT = 2.0
+DEFAULT_CONCURRENCY = 4
+
+# Most UPCs being fetched at once, results are written in input order as they complete
+MAX_PENDING_UPCS = 200
+
+# Rows buffered before they are written out
+FLUSH_EVERY = 100
+
+RESULT_COLUMNS = ["upc", *jUPC.RETAILERS, "average", "minimum", "maximum", "spread"]
+
+
+class RateLimiter:
+    """Token bucket shared by all of a retailer's worker threads."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class RetailerWorker:
+    """Fetches one retailer's prices with its own thread pool, rate limit and counters."""
+
+    def __init__(self, store, get_price, rate, concurrency):
+        self.store = store
+        self.get_price = get_price
+        self.limiter = RateLimiter(rate)
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"jUPC-{store}")
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.unsent = 0
+        self.failures = 0
+        self.fetch_time = 0.0
+
+    def submit(self, upc):
+        return self.executor.submit(self.fetch, upc)
+
+    def fetch(self, upc):
+        # Only wait for the rate limit when a request is really sent, prices answered from a
+        # fresh cache entry or by a disabled retailer don't use up the retailer's rate
+        sent = []
+
+        def before_request():
+            self.limiter.acquire()
+            sent.append(time.perf_counter())
+
+        price = self.get_price(upc, before_request=before_request)
+        with self.lock:
+            if sent:
+                self.requests += 1
+                self.fetch_time += time.perf_counter() - sent[0]
+            else:
+                self.unsent += 1
+            self.failures += price is None
+        return price
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class CSVResultWriter:
+    def __init__(self, path):
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_COLUMNS)
+        if new_file:
+            self.writer.writeheader()
+        self.pending = 0
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.pending += 1
+        if self.pending >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    @staticmethod
+    def completed(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, newline="") as f:
+            return {row["upc"] for row in csv.DictReader(f) if row.get("upc")}
+
+
+class ParquetResultWriter:
+    """Writes every flush as its own part file in a directory, so a crash can't lose more
+    than the rows still buffered."""
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.schema = pa.schema([("upc", pa.string())]
+                                + [(column, pa.float64()) for column in RESULT_COLUMNS[1:]])
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        self.part = len([name for name in os.listdir(path) if name.endswith(".parquet")])
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = self.pa.Table.from_pylist(self.rows, schema=self.schema)
+        part_path = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        # Write under a temporary name first so a half-written part is never picked up
+        self.pq.write_table(table, part_path + ".tmp")
+        os.replace(part_path + ".tmp", part_path)
+        self.part += 1
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+    @staticmethod
+    def completed(path):
+        import pyarrow.parquet as pq
+
+        if not os.path.isdir(path):
+            return set()
+        upcs = set()
+        for name in os.listdir(path):
+            if name.endswith(".parquet"):
+                upcs.update(pq.read_table(os.path.join(path, name), columns=["upc"]).column("upc").to_pylist())
+        return upcs
+
+
+RESULT_WRITERS = {
+    "csv": CSVResultWriter,
+    "parquet": ParquetResultWriter,
+}
+
+
+def read_upcs(source):
+    """Yield UPCs one at a time from a CSV file (a "upc" column, or the first column) or stdin."""
+    f = sys.stdin if source == "-" else open(source, newline="")
+    try:
+        reader = csv.reader(f)
+        column = 0
+        for i, row in enumerate(reader):
+            if not row:
+                continue
+            if i == 0 and "upc" in [cell.strip().lower() for cell in row]:
+                column = [cell.strip().lower() for cell in row].index("upc")
+                continue
+            upc = row[column].strip()
+            if upc:
+                yield upc
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def make_row(upc, prices):
+    avg_price, min_price, max_price, price_spread = jUPC.compute_statistics(prices)
+    return {"upc": upc, **prices, "average": avg_price, "minimum": min_price,
+            "maximum": max_price, "spread": price_spread}
+
+
+def run_batch(upcs, writer, rate_limits=None, concurrency=None, completed=()):
+    """Price every UPC at every retailer, writing a row per UPC in input order.
+
+    Returns the number of UPCs priced and the RetailerWorkers, for the throughput summary.
+    """
+    rate_limits = rate_limits or {}
+    concurrency = concurrency or {}
+    workers = {store: RetailerWorker(store, get_price, rate_limits.get(store, DEFAULT_RATE_LIMIT),
+                                     concurrency.get(store, DEFAULT_CONCURRENCY))
+               for store, get_price in jUPC.RETAILERS.items()}
+    jUPC.session = jUPC.create_session(pool_maxsize=max(worker.concurrency for worker in workers.values()))
+
+    pending = deque()
+    priced = 0
+
+    def write_oldest():
+        upc, futures = pending.popleft()
+        writer.write(make_row(upc, {store: future.result() for store, future in futures.items()}))
+
+    try:
+        for upc in upcs:
+            if upc in completed:
+                continue
+            pending.append((upc, {store: worker.submit(upc) for store, worker in workers.items()}))
+            if len(pending) >= MAX_PENDING_UPCS:
+                write_oldest()
+                priced += 1
+        while pending:
+            write_oldest()
+            priced += 1
+    finally:
+        for worker in workers.values():
+            worker.shutdown()
+    return priced, workers
+
+
+def print_summary(priced, workers, elapsed):
+    print(f"\nPriced {priced} UPCs in {elapsed:.1f}s ({priced / elapsed:.2f} UPCs/s)")
+    for store, worker in workers.items():
+        mean_time = worker.fetch_time / worker.requests if worker.requests else 0
+        print(f"{store}: {worker.requests} requests ({worker.requests / elapsed:.2f} req/s), "
+              f"{worker.unsent} answered without one, {worker.failures} without a price, "
+              f"{mean_time:.2f}s per request")
+    print(f"\n{retailers.format_metrics(retailers.adapters)}")
+    if jUPC.cache:
+        print(jUPC.cache.summary())
+
+
+def parse_store_values(values):
+    """Parse "Store=value" arguments into a dict of floats."""
+    parsed = {}
+    for value in values or []:
+        store, _, number = value.rpartition("=")
+        if store not in jUPC.RETAILERS:
+            raise argparse.ArgumentTypeError(f"Unknown retailer {store!r}, expected one of {', '.join(jUPC.RETAILERS)}")
+        parsed[store] = float(number)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price a list of UPCs at every retailer")
+    parser.add_argument("input", help="CSV of UPCs (a 'upc' column or the first column), or - for stdin")
+    parser.add_argument("--output", required=True, help="CSV file, or directory for parquet")
+    parser.add_argument("--format", choices=sorted(RESULT_WRITERS), default="csv")
+    parser.add_argument("--resume", action="store_true", help="Skip UPCs already in --output")
+    parser.add_argument("--rate", nargs="+", metavar="STORE=REQ_PER_S",
+                        help=f"Per-retailer rate limits (default {DEFAULT_RATE_LIMIT}/s)")
+    parser.add_argument("--concurrency", nargs="+", metavar="STORE=N",
+                        help=f"Per-retailer requests in flight (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--cache", help="Price cache database to answer from and fill")
+    parser.add_argument("--parsers", nargs="+", choices=sorted(extract.BACKENDS), default=extract.DEFAULT_BACKENDS,
+                        help="Price extraction backends to try, in order")
+    args = parser.parse_args()
+    jUPC.set_extract_backends(args.parsers)
+    if args.cache:
+        jUPC.enable_cache(args.cache)
+
+    writer_class = RESULT_WRITERS[args.format]
+    completed = writer_class.completed(args.output) if args.resume else set()
+    if completed:
+        print(f"Resuming, {len(completed)} UPCs already priced")
+    concurrency = {store: int(n) for store, n in parse_store_values(args.concurrency).items()}
+
+    writer = writer_class(args.output)
+    start = time.perf_counter()
+    try:
+        priced, workers = run_batch(read_upcs(args.input), writer, parse_store_values(args.rate),
+                                    concurrency, completed)
+    finally:
+        writer.close()
+    print_summary(priced, workers, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import os
+import re
+import time
+
+from bs4 import BeautifulSoup
+
+# Price extraction backends for jUPC. Retailer search pages run to a megabyte or two and
+# building a full BeautifulSoup tree for each one to find a single span dominates CPU time
+# in batch runs, so the faster backends are tried first and BeautifulSoup is only the fallback:
+#   regex   precompiled pattern per price element, reads the element's leading text
+#   stream  lxml pull parser fed in chunks, stops at the first matching element
+#   lxml    full lxml tree searched with a compiled XPath
+#   selectolax  Lexbor CSS selector, when selectolax is installed
+#   bs4     BeautifulSoup html.parser, as before
+# Benchmark them over saved pages (named after the retailer, e.g. homedepot-1.html):
+#   python extract.py fixtures/ --generate 5
+#   python extract.py fixtures/ --backends regex stream bs4
+
+# Bytes fed to the stream backend at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# The number read out of a price element's text, thousands separators are dropped after
+PRICE_PATTERN = r"\d[\d,]*(?:\.\d+)?"
+
+
+def attribute_matches(name, wanted, value):
+    # class matches any one of an element's classes, like BeautifulSoup does
+    if value is None:
+        return False
+    if name == "class":
+        return wanted in value.split()
+    return value == wanted
+
+
+def element_matches(element, attrs):
+    return all(attribute_matches(name, wanted, element.get(name)) for name, wanted in attrs.items())
+
+
+class RegexExtractor:
+    """Reads the text right after the first opening tag that has the wanted attributes.
+
+    Only the text before the element's first child tag is returned, which is enough for a
+    price and lets the caller fall back when it isn't.
+    """
+
+    def __init__(self, name, attrs):
+        patterns = []
+        for attr, wanted in attrs.items():
+            if attr == "class":
+                value = rf"""(?:[^"']*\s)?{re.escape(wanted)}(?:\s[^"']*)?"""
+            else:
+                value = re.escape(wanted)
+            patterns.append(rf"""(?=[^>]*\s{re.escape(attr)}\s*=\s*["']{value}["'])""")
+        self.pattern = re.compile(rf"<{re.escape(name)}\b{''.join(patterns)}[^>]*>([^<]*)".encode(), re.IGNORECASE)
+
+    def __call__(self, content):
+        match = self.pattern.search(content)
+        return match and match.group(1).decode("utf-8", "replace")
+
+
+class StreamExtractor:
+    def __init__(self, name, attrs):
+        from lxml import etree
+
+        self.etree = etree
+        self.name = name
+        self.attrs = attrs
+
+    def __call__(self, content):
+        parser = self.etree.HTMLPullParser(events=("end",), tag=self.name)
+        for offset in range(0, len(content), STREAM_CHUNK_SIZE):
+            parser.feed(content[offset:offset + STREAM_CHUNK_SIZE])
+            for _, element in parser.read_events():
+                if element_matches(element, self.attrs):
+                    return "".join(element.itertext())
+        return None
+
+
+class LxmlExtractor:
+    def __init__(self, name, attrs):
+        import lxml.html
+        from lxml import etree
+
+        self.lxml_html = lxml.html
+        conditions = []
+        for attr, wanted in attrs.items():
+            if attr == "class":
+                conditions.append(f"contains(concat(' ', normalize-space(@class), ' '), ' {wanted} ')")
+            else:
+                conditions.append(f"@{attr}='{wanted}'")
+        self.xpath = etree.XPath(f"//{name}[{' and '.join(conditions)}]")
+
+    def __call__(self, content):
+        matches = self.xpath(self.lxml_html.document_fromstring(content))
+        return matches[0].text_content() if matches else None
+
+
+class SelectolaxExtractor:
+    def __init__(self, name, attrs):
+        from selectolax.lexbor import LexborHTMLParser
+
+        self.parser = LexborHTMLParser
+        self.selector = name + "".join(f".{wanted}" if attr == "class" else f'[{attr}="{wanted}"]'
+                                       for attr, wanted in attrs.items())
+
+    def __call__(self, content):
+        node = self.parser(content).css_first(self.selector)
+        return node.text() if node else None
+
+
+class SoupExtractor:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __call__(self, content):
+        element = BeautifulSoup(content, "html.parser").find(self.name, self.attrs)
+        return element.get_text() if element else None
+
+
+BACKENDS = {
+    "regex": RegexExtractor,
+    "stream": StreamExtractor,
+    "lxml": LxmlExtractor,
+    "selectolax": SelectolaxExtractor,
+    "bs4": SoupExtractor,
+}
+
+# Backends tried in order until one finds a price
+DEFAULT_BACKENDS = ["regex", "stream", "bs4"]
+
+
+def available_backends():
+    """Backends whose optional dependency is installed."""
+    available = []
+    for name, backend in BACKENDS.items():
+        try:
+            backend("span", {"class": "price"})
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def parse_price_text(text, pattern):
+    match = text and pattern.search(text)
+    return float(match.group().replace(",", "")) if match else None
+
+
+class PriceExtractor:
+    """Finds one price element on a page, trying each backend until one gives a price."""
+
+    def __init__(self, name, attrs, backends=None, price_pattern=PRICE_PATTERN):
+        self.price_pattern = re.compile(price_pattern)
+        self.extractors = []
+        for backend in backends or DEFAULT_BACKENDS:
+            try:
+                self.extractors.append(BACKENDS[backend](name, attrs))
+            except ImportError:
+                pass  # optional backend isn't installed, the later ones still cover it
+
+    def __call__(self, content):
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        for extractor in self.extractors:
+            price = parse_price_text(extractor(content), self.price_pattern)
+            if price is not None:
+                return price
+        return None
+
+
+def fixture_store(path, stores):
+    """Match a fixture such as homedepot-2.html or homedepot/012345.html to its retailer."""
+    prefix = re.split(r"[-_./\\]", path.lower())[0]
+    for store in stores:
+        if re.sub(r"[^a-z0-9]", "", store.lower()) == prefix:
+            return store
+    return None
+
+
+def load_fixtures(directory, stores):
+    """Read every saved page under directory, including pages recorded by replay.py."""
+    fixtures = []
+    for root, _, filenames in sorted(os.walk(directory)):
+        for filename in sorted(filenames):
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            store = fixture_store(path, stores)
+            if store and filename.endswith((".html", ".htm")):
+                with open(os.path.join(root, filename), "rb") as f:
+                    fixtures.append((store, f.read()))
+    return fixtures
+
+
+def generate_fixtures(directory, pages, size=1_500_000):
+    """Write synthetic search pages of roughly `size` bytes with the price near the end."""
+    import random
+
+    import retailers
+
+    os.makedirs(directory, exist_ok=True)
+    filler_row = ('<div class="result"><a href="/p/{0}"><span class="title">Item {0}</span></a>'
+                  '<span class="rating">4.5 out of 5</span><img src="/img/{0}.jpg" alt=""></div>\n')
+    rows = [filler_row.format(i) for i in range(size // len(filler_row))]
+    for store, adapter in retailers.adapters.items():
+        name, attrs = adapter.selector
+        attributes = " ".join(f'{attr}="{wanted}"' for attr, wanted in attrs.items())
+        slug = re.sub(r"[^a-z0-9]", "", store.lower())
+        for i in range(pages):
+            split = random.randint(len(rows) // 2, len(rows))
+            price = f"{random.randint(1, 2000):,}.{random.randint(0, 99):02d}"
+            before, after = "".join(rows[:split]), "".join(rows[split:])
+            html = (f"<!DOCTYPE html><html><head><title>{store}</title></head><body>{before}"
+                    f'<{name} id="p{i}" {attributes}>${price}</{name}>{after}</body></html>')
+            with open(os.path.join(directory, f"{slug}-{i}.html"), "w") as f:
+                f.write(html)
+
+
+def benchmark(fixtures, backends, repeat=1):
+    """Time each backend over every fixture, returns {backend: (pages/s, pages matched)}.
+
+    Backends are timed alone, without the fallback chain, so the numbers compare like for like.
+    """
+    import retailers
+
+    results = {}
+    for backend in backends:
+        extractors = {store: PriceExtractor(*adapter.selector, backends=[backend], price_pattern=adapter.price_pattern)
+                      for store, adapter in retailers.adapters.items()}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            matched = sum(extractors[store](content) is not None for store, content in fixtures)
+        elapsed = time.perf_counter() - start
+        results[backend] = (repeat * len(fixtures) / elapsed, matched)
+    return results
+
+
+if __name__ == "__main__":
+    import retailers
+
+    parser = argparse.ArgumentParser(description="Benchmark price extraction backends over saved HTML pages")
+    parser.add_argument("fixtures", help="Directory of saved pages named after the retailer, e.g. walmart-1.html")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), help="Backends to time (default: all installed)")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the fixtures per backend")
+    parser.add_argument("--generate", type=int, metavar="PAGES",
+                        help="First write this many synthetic pages per retailer into the directory")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_fixtures(args.fixtures, args.generate)
+    fixtures = load_fixtures(args.fixtures, retailers.adapters)
+    if not fixtures:
+        parser.error(f"No fixtures named after a retailer in {args.fixtures}")
+    total_mb = sum(len(content) for _, content in fixtures) / 1e6
+    print(f"{len(fixtures)} pages, {total_mb:.1f} MB")
+    for backend, (pages_per_s, matched) in benchmark(fixtures, args.backends or available_backends(), args.repeat).items():
+        print(f"{backend:>10}: {pages_per_s:8.1f} pages/s ({pages_per_s * total_mb / len(fixtures):.1f} MB/s), "
+              f"price found on {matched}/{len(fixtures)}")
@@ -1,80 +1,110 @@
+import argparse
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 import pandas as pd
 
-
-def get_amazon_price(upc):
-    try:
-        # Example URL structure, actual implementation will vary and require parsing the HTML
-        url = f"https://www.amazon.com/s?k={upc}"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
-        }
-        response = requests.get(url, headers=headers)
-        soup = BeautifulSoup(response.content, "html.parser")
-        price = soup.find("span", {"class": "a-price-whole"}).get_text()
-        return float(price.replace(",", "").replace("$", ""))
-    except Exception as e:
-        print(f"Amazon: {e}")
-        return None
-
-
-def get_walmart_price(upc):
-    try:
-        url = f"https://www.walmart.com/search/?query={upc}"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, "html.parser")
-        price = soup.find("span", {"class": "price-characteristic"}).get_text()
-        return float(price.replace(",", "").replace("$", ""))
-    except Exception as e:
-        print(f"Walmart: {e}")
+import extract
+import price_cache
+import retailers
+
+# Seconds allowed for opening a connection to a retailer
+CONNECT_TIMEOUT = 3.05
+
+
+def create_session(pool_maxsize=4):
+    """Create a shared session so each retailer's connections are kept alive between lookups."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(retailers.adapters), pool_maxsize=pool_maxsize)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+session = create_session()
+
+
+# Price cache shared by every lookup, see enable_cache
+cache = None
+
+
+def enable_cache(path=price_cache.DEFAULT_PATH, **kwargs):
+    global cache
+    kwargs.setdefault("ttls", {name: adapter.cache_ttl for name, adapter in retailers.adapters.items()})
+    cache = price_cache.PriceCache(path, **kwargs)
+    return cache
+
+
+def set_extract_backends(backends=None):
+    """Choose which extract backends are tried, in order, when reading prices off a page."""
+    for adapter in retailers.adapters.values():
+        adapter.set_extract_backends(backends)
+
+
+def fetch_price(store, upc, before_request=None):
+    """Look up one retailer's price, answering from the cache while the entry is fresh.
+
+    A stale entry is revalidated with its ETag/Last-Modified, and served as-is if the
+    retailer errors or its adapter has been disabled. before_request is called right before
+    a request is actually sent, e.g. to wait on a rate limit.
+    """
+    adapter = retailers.adapters[store]
+    entry = cache.get(store, upc) if cache else None
+    if entry and cache.is_fresh(entry):
+        cache.count(store, "hits")
+        return entry["price"]
+
+    headers = {}
+    if entry and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    response = price = None
+    if adapter.enabled:
+        if before_request:
+            before_request()
+        try:
+            response, price = adapter.fetch(session, upc, headers, CONNECT_TIMEOUT)
+        except Exception as e:
+            print(f"{store}: {e}")
+
+    if response is not None and price is None and entry:
+        cache.refresh(store, upc)
+        cache.count(store, "revalidated")
+        return entry["price"]
+    if price is None:
+        if entry:
+            cache.count(store, "stale")
+            return entry["price"]
+        if cache:
+            cache.count(store, "misses")
         return None
+    if cache:
+        cache.put(store, upc, price, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        cache.count(store, "misses")
+    return price
 
 
-def get_target_price(upc):
-    try:
-        url = f"https://www.target.com/s?searchTerm={upc}"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, "html.parser")
-        price = soup.find("span", {"data-test": "product-price"}).get_text()
-        return float(price.replace(",", "").replace("$", ""))
-    except Exception as e:
-        print(f"Target: {e}")
-        return None
+RETAILERS = {name: functools.partial(fetch_price, name) for name in retailers.adapters}
 
-
-def get_homedepot_price(upc):
-    try:
-        url = f"https://www.homedepot.com/s/{upc}"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, "html.parser")
-        price = soup.find("span", {"class": "price__dollars"}).get_text()
-        return float(price.replace(",", "").replace("$", ""))
-    except Exception as e:
-        print(f"Home Depot: {e}")
-        return None
-
-
-def get_lowes_price(upc):
-    try:
-        url = f"https://www.lowes.com/search?searchTerm={upc}"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, "html.parser")
-        price = soup.find("span", {"class": "price"}).get_text()
-        return float(price.replace(",", "").replace("$", ""))
-    except Exception as e:
-        print(f"Lowe's: {e}")
-        return None
+executor = ThreadPoolExecutor(max_workers=len(RETAILERS), thread_name_prefix="jUPC")
 
 
 def get_prices(upc):
-    prices = {
-        "Amazon": get_amazon_price(upc),
-        "Walmart": get_walmart_price(upc),
-        "Target": get_target_price(upc),
-        "Home Depot": get_homedepot_price(upc),
-        "Lowe's": get_lowes_price(upc),
-    }
+    """Fetch every retailer's price at once, a retailer that runs past its timeout is None."""
+    start = time.monotonic()
+    futures = {store: executor.submit(get_price, upc) for store, get_price in RETAILERS.items()}
+    prices = {}
+    for store, future in futures.items():
+        timeout = retailers.adapters[store].timeout
+        remaining = start + timeout - time.monotonic()
+        try:
+            prices[store] = future.result(timeout=max(0, remaining))
+        except TimeoutError:
+            print(f"{store}: timed out after {timeout}s")
+            prices[store] = None
     return prices
 
 
@@ -120,12 +150,24 @@ def display_results(prices):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Compare a UPC's price across retailers")
+    parser.add_argument("--cache", default=price_cache.DEFAULT_PATH, help="Price cache database")
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch fresh prices")
+    parser.add_argument("--parsers", nargs="+", choices=sorted(extract.BACKENDS), default=extract.DEFAULT_BACKENDS,
+                        help="Price extraction backends to try, in order")
+    args = parser.parse_args()
+    set_extract_backends(args.parsers)
+    if not args.no_cache:
+        enable_cache(args.cache)
+
     while True:
         upc = input("Enter a UPC code (or 'exit' to quit): ")
         if upc.lower() == "exit":
             break
         prices = get_prices(upc)
         display_results(prices)
+        if cache:
+            print(f"\n{cache.summary()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+DEFAULT_PATH = "jupc_cache.sqlite"
+
+# Seconds a cached price is served without asking the retailer again
+DEFAULT_TTL = 6 * 60 * 60
+
+# Entries kept before the least recently used ones are evicted
+MAX_ENTRIES = 100_000
+
+# Writes between eviction checks
+EVICT_EVERY = 100
+
+COUNTER_KINDS = ["hits", "misses", "revalidated", "stale"]
+
+
+class PriceCache:
+    """On-disk cache of retailer prices keyed by (retailer, upc).
+
+    Each entry keeps the ETag and Last-Modified the retailer sent so a stale entry can be
+    revalidated instead of downloaded again. Safe to share between threads.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttls=None, default_ttl=DEFAULT_TTL, max_entries=MAX_ENTRIES):
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.writes = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS prices (
+                store TEXT NOT NULL,
+                upc TEXT NOT NULL,
+                price REAL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (store, upc)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS prices_accessed_at ON prices (accessed_at)")
+
+    def get(self, store, upc):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT price, etag, last_modified, fetched_at FROM prices WHERE store = ? AND upc = ?",
+                (store, upc)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE prices SET accessed_at = ? WHERE store = ? AND upc = ?",
+                              (time.time(), store, upc))
+        price, etag, last_modified, fetched_at = row
+        return {"store": store, "upc": upc, "price": price, "etag": etag,
+                "last_modified": last_modified, "fetched_at": fetched_at}
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttls.get(entry["store"], self.default_ttl)
+
+    def put(self, store, upc, price, etag=None, last_modified=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (store, upc, price, etag, last_modified, now, now))
+            self.writes += 1
+            if self.writes % EVICT_EVERY == 0:
+                self.evict()
+
+    def refresh(self, store, upc):
+        """Mark an entry as fresh again after the retailer said it hasn't changed."""
+        with self.lock:
+            self.conn.execute("UPDATE prices SET fetched_at = ? WHERE store = ? AND upc = ?",
+                              (time.time(), store, upc))
+
+    def evict(self):
+        excess = self.conn.execute("SELECT COUNT(*) FROM prices").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.conn.execute("DELETE FROM prices WHERE rowid IN "
+                              "(SELECT rowid FROM prices ORDER BY accessed_at LIMIT ?)", (excess,))
+
+    def count(self, store, kind):
+        with self.lock:
+            self.counters.setdefault(store, Counter())[kind] += 1
+
+    def totals(self):
+        with self.lock:
+            return sum(self.counters.values(), Counter())
+
+    def summary(self):
+        totals = self.totals()
+        return "Cache: " + ", ".join(f"{totals[kind]} {kind}" for kind in COUNTER_KINDS)
+
+    def close(self):
+        self.conn.close()
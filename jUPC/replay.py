@@ -0,0 +1,245 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import batch
+import extract
+import jUPC
+import retailers
+
+# Offline record/replay for jUPC. Retailer pages are recorded once into a fixture directory
+# (one folder per retailer, one page per UPC) and then served by a local stand-in server with
+# added latency, jitter and errors, so the scrapers can be benchmarked without the live sites:
+#   python replay.py record fixtures/ upcs.csv
+#   python replay.py serve fixtures/ --latency-ms 150 --jitter-ms 50 --error-rate 0.02
+#   python replay.py bench fixtures/ --upcs 200 --concurrency 1 4 16
+# bench starts its own stand-in server, so serve is only needed to point other tools at one.
+
+# Status codes the stand-in answers with when it injects an error
+ERROR_STATUSES = [500, 502, 503]
+
+
+def fixture_path(directory, adapter, upc):
+    return os.path.join(directory, adapter.slug, f"{upc}.html")
+
+
+def record_fixtures(directory, upcs):
+    """Save every retailer's live page for each UPC, returns the number of pages saved."""
+    saved = 0
+    for upc in upcs:
+        for adapter in retailers.adapters.values():
+            try:
+                response = jUPC.session.get(adapter.url.format(upc=upc), headers=adapter.headers,
+                                            timeout=(jUPC.CONNECT_TIMEOUT, adapter.timeout))
+                response.raise_for_status()
+            except Exception as e:
+                print(f"{adapter.name}: {e}")
+                continue
+            path = fixture_path(directory, adapter, upc)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(response.content)
+            saved += 1
+    return saved
+
+
+def load_recordings(directory):
+    """Read recorded pages into {retailer slug: {upc: page}}, flat extract.py fixtures included."""
+    recordings = {adapter.slug: {} for adapter in retailers.adapters.values()}
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            store = extract.fixture_store(path, retailers.adapters)
+            if store and filename.endswith((".html", ".htm")):
+                with open(os.path.join(root, filename), "rb") as f:
+                    recordings[retailers.adapters[store].slug][os.path.splitext(filename)[0]] = f.read()
+    return recordings
+
+
+def start_replay_server(recordings, host="127.0.0.1", port=0, latency_ms=0, jitter_ms=0, error_rate=0.0):
+    """Serve recorded pages at /<retailer slug>/<upc> on a background thread.
+
+    A UPC that wasn't recorded gets one of the retailer's other pages, so any UPC list can be
+    replayed. Pages carry an ETag and conditional requests are answered with 304.
+    """
+    pages = {slug: list(by_upc.values()) for slug, by_upc in recordings.items()}
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real sites
+
+        def do_GET(self):
+            _, slug, upc = (self.path.split("?")[0].split("/", 2) + ["", ""])[:3]
+            delay = random.gauss(latency_ms, jitter_ms) if jitter_ms else latency_ms
+            time.sleep(max(0.0, delay) / 1000)
+            if not pages.get(slug):
+                self.send_error(404)
+                return
+            if random.random() < error_rate:
+                self.send_error(random.choice(ERROR_STATUSES))
+                return
+            page = recordings[slug].get(upc) or random.choice(pages[slug])
+            etag = '"' + hashlib.sha1(page).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(page)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReplayHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def point_adapters_at(base_url):
+    """Send every retailer's requests to the stand-in server at base_url."""
+    for adapter in retailers.adapters.values():
+        adapter.url = f"{base_url}/{adapter.slug}/{{upc}}"
+
+
+def reset_adapters():
+    for adapter in retailers.adapters.values():
+        adapter.metrics = retailers.AdapterMetrics()
+        adapter.enable()
+
+
+class CountingWriter:
+    """Batch result writer that only counts rows, so the benchmark measures fetching."""
+
+    def __init__(self):
+        self.rows = 0
+        self.priced = 0
+
+    def write(self, row):
+        self.rows += 1
+        self.priced += sum(row[store] is not None for store in retailers.adapters)
+
+    def close(self):
+        pass
+
+
+def bench_get_prices(upcs, concurrency):
+    """Run get_prices over every UPC from `concurrency` caller threads.
+
+    Returns (UPCs done, prices found)."""
+    executor, jUPC.executor = jUPC.executor, ThreadPoolExecutor(max_workers=concurrency * len(jUPC.RETAILERS))
+    jUPC.session = jUPC.create_session(pool_maxsize=concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as callers:
+            results = list(callers.map(jUPC.get_prices, upcs))
+    finally:
+        jUPC.executor.shutdown(wait=True, cancel_futures=True)
+        jUPC.executor = executor
+    return len(results), sum(price is not None for prices in results for price in prices.values())
+
+
+def bench_batch(upcs, concurrency):
+    """Run the batch pipeline over every UPC with no rate limit, returns (UPCs done, prices found)."""
+    writer = CountingWriter()
+    unlimited = {store: 1e9 for store in retailers.adapters}
+    batch.run_batch(iter(upcs), writer, unlimited, {store: concurrency for store in retailers.adapters})
+    return writer.rows, writer.priced
+
+
+BENCH_MODES = {
+    "get_prices": bench_get_prices,
+    "batch": bench_batch,
+}
+
+
+def run_benchmark(upcs, modes, concurrency_levels, verbose=False):
+    """Time every mode at every concurrency level, returns a list of result dicts."""
+    results = []
+    for mode in modes:
+        for concurrency in concurrency_levels:
+            reset_adapters()
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+            start = time.perf_counter()
+            with output:
+                done, priced = BENCH_MODES[mode](upcs, concurrency)
+            elapsed = time.perf_counter() - start
+            results.append({"mode": mode, "concurrency": concurrency, "upcs": done, "seconds": elapsed,
+                            "upcs_per_s": done / elapsed,
+                            "found": priced / (done * len(retailers.adapters)) if done else 0})
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record retailer pages and replay them for offline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record = subparsers.add_parser("record", help="Save every retailer's page for a list of UPCs")
+    record.add_argument("fixtures", help="Directory to save the pages in")
+    record.add_argument("input", help="CSV of UPCs (a 'upc' column or the first column), or - for stdin")
+
+    for name, help_text in (("serve", "Serve recorded pages from a local stand-in server"),
+                            ("bench", "Measure UPCs/s against a local stand-in server")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("fixtures", help="Directory of recorded pages")
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=8900 if name == "serve" else 0)
+        sub.add_argument("--latency-ms", type=float, default=100, help="Mean delay before each page")
+        sub.add_argument("--jitter-ms", type=float, default=30, help="Standard deviation of the delay")
+        sub.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 5xx")
+
+    bench = subparsers.choices["bench"]
+    bench.add_argument("--upcs", default="100", help="Number of made-up UPCs, or a CSV of UPCs to use")
+    bench.add_argument("--modes", nargs="+", choices=list(BENCH_MODES), default=list(BENCH_MODES))
+    bench.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16],
+                       help="Callers for get_prices, requests in flight per retailer for batch")
+    bench.add_argument("--verbose", action="store_true", help="Show the scrapers' own output")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "record":
+        saved = record_fixtures(args.fixtures, batch.read_upcs(args.input))
+        print(f"Saved {saved} pages to {args.fixtures}")
+    else:
+        recordings = load_recordings(args.fixtures)
+        empty = [slug for slug, pages in recordings.items() if not pages]
+        if len(empty) == len(recordings):
+            raise SystemExit(f"No recorded pages in {args.fixtures}")
+        if empty:
+            print(f"No pages recorded for {', '.join(empty)}, their requests will fail")
+        server = start_replay_server(recordings, args.host, args.port, args.latency_ms, args.jitter_ms,
+                                     args.error_rate)
+        base_url = f"http://{args.host}:{server.server_address[1]}"
+
+        if args.command == "serve":
+            print(f"Replaying {sum(len(pages) for pages in recordings.values())} pages on {base_url}/<retailer>/<upc>")
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                server.shutdown()
+        else:
+            point_adapters_at(base_url)
+            if args.upcs.isdigit():
+                upcs = [f"{random.randrange(10 ** 11, 10 ** 12)}" for _ in range(int(args.upcs))]
+            else:
+                upcs = list(batch.read_upcs(args.upcs))
+            print(f"{len(upcs)} UPCs, {args.latency_ms:.0f} ms +/- {args.jitter_ms:.0f} ms latency, "
+                  f"{args.error_rate:.0%} errors")
+            for result in run_benchmark(upcs, args.modes, args.concurrency, args.verbose):
+                print(f"{result['mode']:>10} x{result['concurrency']:<3}: {result['upcs_per_s']:7.2f} UPCs/s "
+                      f"({result['upcs']} in {result['seconds']:.1f}s, {result['found']:.0%} of prices found)")
+            server.shutdown()
@@ -0,0 +1,227 @@
+import re
+import threading
+import time
+from collections import deque
+
+import extract
+
+# Retailer adapters for jUPC. Each retailer is described by config alone (where its search
+# page is, which element holds the price and how to clean it) and registered in `adapters`.
+# Every adapter keeps its own latency histogram, success rate and bytes downloaded, and turns
+# itself off for a while once too many of its recent requests fail so a broken store can't slow
+# a batch down. A page without a price isn't a failure, most stores don't stock most UPCs.
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket catches the rest
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# An adapter is disabled when more than this fraction of its last ERROR_WINDOW requests failed
+# with a connection error, timeout or 5xx, and tried again after ERROR_COOLDOWN seconds
+ERROR_BUDGET = 0.5
+ERROR_WINDOW = 20
+ERROR_COOLDOWN = 5 * 60
+
+DEFAULT_TIMEOUT = 8
+DEFAULT_CACHE_TTL = 6 * 60 * 60
+
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+}
+
+RETAILER_CONFIGS = [
+    {
+        "name": "Amazon",
+        "url": "https://www.amazon.com/s?k={upc}",
+        "headers": BROWSER_HEADERS,
+        "selector": ("span", {"class": "a-price-whole"}),
+        "timeout": 10,
+        "cache_ttl": 2 * 60 * 60,
+    },
+    {
+        "name": "Walmart",
+        "url": "https://www.walmart.com/search/?query={upc}",
+        "selector": ("span", {"class": "price-characteristic"}),
+    },
+    {
+        "name": "Target",
+        "url": "https://www.target.com/s?searchTerm={upc}",
+        "selector": ("span", {"data-test": "product-price"}),
+    },
+    {
+        "name": "Home Depot",
+        "url": "https://www.homedepot.com/s/{upc}",
+        "selector": ("span", {"class": "price__dollars"}),
+        "cache_ttl": 12 * 60 * 60,
+    },
+    {
+        "name": "Lowe's",
+        "url": "https://www.lowes.com/search?searchTerm={upc}",
+        "selector": ("span", {"class": "price"}),
+        "cache_ttl": 12 * 60 * 60,
+    },
+]
+
+
+class AdapterMetrics:
+    """Request counters and a latency histogram, safe to update from many threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.successes = 0
+        self.misses = 0
+        self.bytes = 0
+        self.latency_total = 0.0
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.recent = deque(maxlen=ERROR_WINDOW)
+
+    def record(self, elapsed, ok, size=0, missed=False):
+        """Record a request, ok when it gave a price and missed when the page had none."""
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if elapsed <= bound), len(LATENCY_BUCKETS))
+        with self.lock:
+            self.requests += 1
+            self.successes += ok
+            self.misses += missed
+            self.bytes += size
+            self.latency_total += elapsed
+            self.latency_counts[bucket] += 1
+            self.recent.append(ok or missed)
+
+    @property
+    def success_rate(self):
+        return self.successes / self.requests if self.requests else None
+
+    def recent_failure_rate(self):
+        """Fraction of the last ERROR_WINDOW requests that failed, not counting pages without a
+        price, None until the window is full."""
+        with self.lock:
+            if len(self.recent) < ERROR_WINDOW:
+                return None
+            return 1 - sum(self.recent) / len(self.recent)
+
+    def latency_quantile(self, q):
+        """Upper bound of the histogram bucket holding quantile q, inf if it's the overflow bucket."""
+        with self.lock:
+            counts = list(self.latency_counts)
+        rank = q * sum(counts)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + [float("inf")], counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+
+class RetailerAdapter:
+    def __init__(self, name, url, selector, headers=None, timeout=DEFAULT_TIMEOUT,
+                 price_pattern=extract.PRICE_PATTERN, cache_ttl=DEFAULT_CACHE_TTL, error_budget=ERROR_BUDGET,
+                 error_cooldown=ERROR_COOLDOWN):
+        self.name = name
+        self.url = url
+        self.selector = selector
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.price_pattern = price_pattern
+        self.cache_ttl = cache_ttl
+        self.error_budget = error_budget
+        self.error_cooldown = error_cooldown
+        self.metrics = AdapterMetrics()
+        self.disabled_reason = None
+        self.retry_at = None
+        self.set_extract_backends()
+
+    @property
+    def slug(self):
+        """Name used for the retailer's fixtures and replay URLs, e.g. homedepot."""
+        return re.sub(r"[^a-z0-9]", "", self.name.lower())
+
+    @property
+    def enabled(self):
+        """False while the adapter is disabled, until its cool-down is over and it may try again."""
+        return self.disabled_reason is None or time.monotonic() >= self.retry_at
+
+    def set_extract_backends(self, backends=None):
+        self.extractor = extract.PriceExtractor(*self.selector, backends=backends, price_pattern=self.price_pattern)
+
+    def parse_price(self, content):
+        price = self.extractor(content)
+        if price is None:
+            raise ValueError("no price found on the page")
+        return price
+
+    def fetch(self, session, upc, headers=None, connect_timeout=None):
+        """Request the retailer's page for a UPC and read the price off it.
+
+        Returns (response, price), price is None when the retailer answered 304 Not Modified.
+        Every call is recorded in the adapter's metrics, errors are raised to the caller. Only
+        connection errors, timeouts, 429s and 5xx count against the error budget, a page that
+        loads without a price or a 4xx for a product the store doesn't carry are misses.
+        """
+        start = time.perf_counter()
+        response = None
+        try:
+            response = session.get(self.url.format(upc=upc), headers={**self.headers, **(headers or {})},
+                                   timeout=(connect_timeout, self.timeout))
+            if response.status_code == 304:
+                price = None
+            else:
+                response.raise_for_status()
+                price = self.parse_price(response.content)
+        except Exception:
+            missed = response is not None and response.status_code < 500 and response.status_code != 429
+            self.record(start, False, response, missed)
+            raise
+        self.record(start, True, response)
+        return response, price
+
+    def record(self, start, ok, response, missed=False):
+        self.metrics.record(time.perf_counter() - start, ok, len(response.content) if response is not None else 0,
+                            missed)
+        if self.disabled_reason is not None:
+            # A request after the cool-down, the adapter comes back unless it failed again
+            if ok or missed:
+                self.enable()
+                print(f"{self.name}: enabled again")
+            else:
+                self.retry_at = time.monotonic() + self.error_cooldown
+            return
+        failure_rate = self.metrics.recent_failure_rate()
+        if failure_rate is not None and failure_rate > self.error_budget:
+            self.disabled_reason = f"{failure_rate:.0%} of the last {ERROR_WINDOW} requests failed"
+            self.retry_at = time.monotonic() + self.error_cooldown
+            print(f"{self.name}: disabled for {self.error_cooldown}s, {self.disabled_reason}")
+
+    def enable(self):
+        self.disabled_reason = None
+        self.retry_at = None
+        self.metrics.recent.clear()
+
+
+adapters = {}
+
+
+def register_adapter(**config):
+    adapter = RetailerAdapter(**config)
+    adapters[adapter.name] = adapter
+    return adapter
+
+
+for config in RETAILER_CONFIGS:
+    register_adapter(**config)
+
+
+def format_metrics(adapters):
+    """One line per adapter with its success rate, latency and download volume."""
+    lines = []
+    for name, adapter in adapters.items():
+        metrics = adapter.metrics
+        if not metrics.requests:
+            lines.append(f"{name}: no requests" + ("" if adapter.enabled else f" (disabled, {adapter.disabled_reason})"))
+            continue
+        p50, p95 = metrics.latency_quantile(0.5), metrics.latency_quantile(0.95)
+        line = (f"{name}: {metrics.requests} requests, {metrics.success_rate:.0%} ok, "
+                f"{metrics.misses} without a price, mean {metrics.latency_total / metrics.requests:.2f}s, "
+                f"p50 <= {p50}s, p95 <= {p95}s, {metrics.bytes / 1e6:.1f} MB")
+        if not adapter.enabled:
+            line += f" (disabled, {adapter.disabled_reason})"
+        lines.append(line)
+    return "\n".join(lines)